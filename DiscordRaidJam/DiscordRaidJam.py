@@ -1,14 +1,34 @@
 ﻿import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import aiohttp
+import hashlib
+import io
 import json
 import asyncio
-from urllib.parse import quote, urlparse, parse_qs
+from urllib.parse import quote
 import requests
+import yaml
 import os
+import re
+import sqlite3
+import time
 from dataclasses import dataclass, asdict
-from typing import List, Dict, Optional
+from typing import Awaitable, Callable, List, Dict, Optional
+from collections import OrderedDict, deque
+from itertools import islice
+from statistics import median
+
+from utils import (
+    PARTNER_BUFFS, PROGRESS_PULLS_SQL, REGIONS, UNLISTED_REGIONS, WORLD_REGIONS, ApiBudget, CircuitBreaker, Fight,
+    PrefixIndex, Role, SWRCache, TTLCache, WipeSession, WorldMetadata,
+    align_encounters, backoff_delay, batch_character_query, batch_character_variables, close_worlds, find_world,
+    parse_character, parse_report_link, parse_retry_after, project_rankings, scope_fights, sparkline, summarize_fights,
+    watch_interval,
+)
+from analysis import (
+    VectorPartnerCalculator, dump_partner_part, load_partner_part, merge_partner_totals, partner_rows
+)
 
 # === Load config ===
 # config.json       = Live
@@ -24,39 +44,351 @@ GUILD_ID = 693821560028528680
 # === Bot setup (enable members intent for role toggling) ===
 intents = discord.Intents.default()
 intents.members = True  # needed for role assignment
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Privileged; only needed for link prefetching and must also be enabled in the developer portal
+intents.message_content = bool(config.get("message_content_intent", False))
+# "interaction" (default): no chunking at startup and no member cache; panels resolve members
+# from the interaction payload or on demand. "full": chunk and cache every member of every guild.
+MEMBER_CACHE_POLICY = config.get("member_cache", "interaction")
+if MEMBER_CACHE_POLICY == "full":
+    bot = commands.Bot(command_prefix="!", intents=intents)
+else:
+    bot = commands.Bot(
+        command_prefix="!",
+        intents=intents,
+        member_cache_flags=discord.MemberCacheFlags.none(),
+        chunk_guilds_at_startup=False,
+    )
 tree = bot.tree
 access_token = None
+background_tasks = set()  # strong refs for fire-and-forget tasks
+
+# =========================
+# Storage (SQLite)
+# =========================
+DB_FILE = "raidjam.db"
+SCHEMA = """
+-- One row per distinct character the watcher polls, shared by every subscription
+CREATE TABLE IF NOT EXISTS watched_characters (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    server TEXT NOT NULL,
+    region TEXT NOT NULL,
+    last_report_start INTEGER NOT NULL DEFAULT 0,  -- watermark: startTime (ms) of newest seen report
+    last_report_code TEXT,
+    last_activity REAL NOT NULL DEFAULT 0,         -- unix time of newest seen report
+    next_poll_at REAL NOT NULL DEFAULT 0,
+    initialized INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,             -- consecutive polls FFLogs did not find the character
+    UNIQUE (name, server, region)
+);
+CREATE INDEX IF NOT EXISTS idx_watched_next_poll ON watched_characters (next_poll_at);
+CREATE TABLE IF NOT EXISTS character_subscriptions (
+    character_id INTEGER NOT NULL REFERENCES watched_characters (id) ON DELETE CASCADE,
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    last_alert_at REAL NOT NULL DEFAULT 0,
+    alerted_start INTEGER NOT NULL DEFAULT 0,  -- startTime (ms) of the newest report announced here
+    PRIMARY KEY (character_id, guild_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_guild ON character_subscriptions (guild_id, user_id);
+CREATE TABLE IF NOT EXISTS static_rosters (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (guild_id, name)
+);
+CREATE TABLE IF NOT EXISTS static_members (
+    roster_id INTEGER NOT NULL REFERENCES static_rosters (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    server TEXT NOT NULL,
+    region TEXT NOT NULL,
+    PRIMARY KEY (roster_id, position)
+);
+-- Keyed by Discord user id (the primary key is the index /mylogs looks up)
+CREATE TABLE IF NOT EXISTS main_characters (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    server TEXT NOT NULL,
+    region TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_activity (
+    user_id INTEGER PRIMARY KEY,
+    last_command_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_user_activity_last ON user_activity (last_command_at);
+-- Append-only store of every boss pull the bot has fetched, queried by /progress.
+-- start_at is absolute (report start + fight offset, unix ms) so pulls order across reports.
+CREATE TABLE IF NOT EXISTS fight_store (
+    report_code TEXT NOT NULL,
+    fight_id INTEGER NOT NULL,
+    encounter_id INTEGER NOT NULL,
+    encounter_name TEXT NOT NULL,
+    start_at INTEGER NOT NULL,
+    duration INTEGER NOT NULL,  -- ms
+    kill INTEGER NOT NULL,
+    boss_pct REAL NOT NULL,
+    PRIMARY KEY (report_code, fight_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_fight_store_encounter ON fight_store (encounter_id, start_at);
+CREATE TABLE IF NOT EXISTS report_guilds (
+    guild_id INTEGER NOT NULL,
+    report_code TEXT NOT NULL,
+    PRIMARY KEY (guild_id, report_code)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id INTEGER PRIMARY KEY,
+    prefetch_links INTEGER NOT NULL DEFAULT 0
+);
+-- Single row: worldData zones/encounters/partitions as JSON. `format` changes with the shape
+-- of what is stored; `version` is a hash of the content.
+CREATE TABLE IF NOT EXISTS world_metadata (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    format INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    zones TEXT NOT NULL
+);
+-- One row per /wipecounter session ("channel:<id>" or "user:<id>"); state is the session's JSON
+CREATE TABLE IF NOT EXISTS wipe_sessions (
+    scope TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- Long analyses queued by commands and run by background workers. `checkpoint` keeps the
+-- finished parts (JSON) so a job interrupted by a restart, or a failed one run again, resumes.
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued | running | done | failed | cancelled
+    progress TEXT NOT NULL DEFAULT '',
+    checkpoint TEXT NOT NULL DEFAULT '{}',
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs (status, id);
+"""
+# Columns added to tables after they first shipped: (table, column, definition, backfill)
+SCHEMA_COLUMNS = [
+    ("watched_characters", "misses", "INTEGER NOT NULL DEFAULT 0", None),
+    ("character_subscriptions", "alerted_start", "INTEGER NOT NULL DEFAULT 0",
+     """UPDATE character_subscriptions SET alerted_start =
+        (SELECT last_report_start FROM watched_characters w WHERE w.id = character_id)"""),
+]
+db_conn: Optional[sqlite3.Connection] = None
+
+def migrate_columns(db: sqlite3.Connection) -> None:
+    for table, column, definition, backfill in SCHEMA_COLUMNS:
+        if column in {r["name"] for r in db.execute(f"PRAGMA table_info({table})")}:
+            continue
+        with db:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            if backfill:
+                db.execute(backfill)
+
+def get_db() -> sqlite3.Connection:
+    global db_conn
+    if db_conn is None:
+        db_conn = sqlite3.connect(DB_FILE)
+        db_conn.row_factory = sqlite3.Row
+        db_conn.execute("PRAGMA foreign_keys = ON")
+        db_conn.execute("PRAGMA journal_mode = WAL")
+        db_conn.executescript(SCHEMA)
+        migrate_columns(db_conn)
+    return db_conn
+
+def record_fights(report_code: str, report_start: int, fights: List[dict], guild_ids=()) -> None:
+    # Boss pulls only; rows already stored (same report and fight id) are left untouched
+    rows = [
+        (report_code, f["id"], f["encounterID"], f.get("name") or f"Encounter {f['encounterID']}",
+         report_start + f["startTime"], f["endTime"] - f["startTime"], int(bool(f.get("kill"))),
+         100.0 if f.get("bossPercentage") is None else f["bossPercentage"])
+        for f in fights if f.get("encounterID")
+    ]
+    db = get_db()
+    with db:
+        db.executemany("INSERT OR IGNORE INTO fight_store VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    link_report(report_code, guild_ids)
+
+def link_report(report_code: str, guild_ids) -> None:
+    # /progress only looks at reports that were fetched for the guild
+    db = get_db()
+    with db:
+        db.executemany(
+            "INSERT OR IGNORE INTO report_guilds (guild_id, report_code) VALUES (?, ?)",
+            [(gid, report_code) for gid in guild_ids if gid]
+        )
 
 # =========================
 # FFLOGS
 # =========================
-async def get_fflogs_token():
+FFLOGS_API_URL = "https://www.fflogs.com/api/v2/client"
+FFLOGS_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5)
+FFLOGS_MAX_ATTEMPTS = 4
+FFLOGS_MAX_RETRY_AFTER = 30  # seconds; longer 429 waits fail instead of holding the interaction
+fflogs_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+fflogs_budget = ApiBudget()  # hourly API points, refreshed from rateLimitData on batched queries
+token_expires_at = 0.0
+http_session: Optional[aiohttp.ClientSession] = None
+
+class FFLogsError(Exception):
+    pass
+
+class FFLogsUnavailable(FFLogsError):
+    pass
+
+def get_http_session() -> aiohttp.ClientSession:
+    # One shared session (connection pool) for every FFLogs call
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(timeout=FFLOGS_TIMEOUT)
+    return http_session
+
+async def get_fflogs_token(force_refresh: bool = False):
     # Guard if credentials are commented out
     if 'FFLOGS_CLIENT_ID' not in globals() or 'FFLOGS_CLIENT_SECRET' not in globals():
         raise RuntimeError("FFLogs credentials not configured.")
-    global access_token
+    global access_token, token_expires_at
+    if access_token and not force_refresh and time.monotonic() < token_expires_at:
+        return access_token
     url = "https://www.fflogs.com/oauth/token"
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            url,
-            data={
-                "grant_type": "client_credentials",
-                "client_id": FFLOGS_CLIENT_ID,
-                "client_secret": FFLOGS_CLIENT_SECRET
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        ) as resp:
-            data = await resp.json()
-            access_token = data.get("access_token")
-            print("✅ FFLogs v2 token acquired.")
+    async with get_http_session().post(
+        url,
+        data={
+            "grant_type": "client_credentials",
+            "client_id": FFLOGS_CLIENT_ID,
+            "client_secret": FFLOGS_CLIENT_SECRET
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    ) as resp:
+        resp.raise_for_status()
+        data = await resp.json()
+        access_token = data.get("access_token")
+        # Renew a minute early so in-flight queries never carry an expired token
+        token_expires_at = time.monotonic() + max(0, data.get("expires_in", 3600) - 60)
+        print("✅ FFLogs v2 token acquired.")
     return access_token
 
-async def fetch_fflogs_v2(query, variables, headers):
-    url = "https://www.fflogs.com/api/v2/client"
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json={"query": query, "variables": variables}, headers=headers) as resp:
-            return await resp.json()
+async def fetch_fflogs_v2(query, variables):
+    # All bot queries are read-only GraphQL, so transient failures are safe to retry.
+    # 5xx/timeouts back off with jitter, 429 honours Retry-After, and once the breaker
+    # opens we fail fast instead of stacking hung requests on a down API.
+    token = fflogs_breaker.allow()
+    if token is None:
+        raise FFLogsUnavailable("FFLogs is not responding right now, please try again in a minute.")
+    try:
+        return await post_fflogs_v2(query, variables, token)
+    except BaseException:
+        fflogs_breaker.release(token)  # no-op unless this was a trial that recorded no outcome
+        raise
+
+async def post_fflogs_v2(query, variables, token: int):
+    last_error: Optional[BaseException] = None
+    for attempt in range(FFLOGS_MAX_ATTEMPTS):
+        delay = backoff_delay(attempt)
+        try:
+            token = await get_fflogs_token()
+            headers = {"Authorization": f"Bearer {token}"}
+            async with get_http_session().post(FFLOGS_API_URL, json={"query": query, "variables": variables}, headers=headers) as resp:
+                if resp.status == 401:
+                    await get_fflogs_token(force_refresh=True)
+                    last_error = FFLogsError("FFLogs rejected the access token")
+                    continue
+                if resp.status == 429:
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    if retry_after is not None and retry_after > FFLOGS_MAX_RETRY_AFTER:
+                        fflogs_breaker.record_success(token)
+                        raise FFLogsError(f"FFLogs rate limit reached, retry in {int(retry_after)}s")
+                    last_error = FFLogsError("FFLogs rate limit reached")
+                    delay = retry_after if retry_after is not None else delay
+                elif resp.status >= 500:
+                    last_error = FFLogsError(f"FFLogs returned HTTP {resp.status}")
+                else:
+                    fflogs_breaker.record_success(token)
+                    if resp.status >= 400:
+                        raise FFLogsError(f"FFLogs returned HTTP {resp.status}")
+                    payload = await resp.json()
+                    if payload.get("errors"):
+                        raise FFLogsError(payload["errors"][0].get("message", "Unknown GraphQL error"))
+                    return payload["data"]
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            last_error = e
+        if attempt + 1 < FFLOGS_MAX_ATTEMPTS:
+            await asyncio.sleep(delay)
+    fflogs_breaker.record_failure(token)
+    raise FFLogsUnavailable(f"FFLogs request failed after {FFLOGS_MAX_ATTEMPTS} attempts: {last_error}") from last_error
+
+def stale_note(age: float) -> str:
+    return f"⚠️ FFLogs is unavailable; showing cached data from {int(age // 60)} min ago."
+
+ROLE_ICONS = {Role.TANK: "🛡️", Role.HEALER: "💖", Role.DPS: "⚔️"}
+
+# === FFLogs world metadata ===
+# Zones, encounters and partitions change a few times per patch: fetched once, kept in SQLite,
+# served from memory and re-checked in the background.
+WORLD_METADATA_QUERY = """
+query {
+  worldData {
+    zones {
+      id
+      name
+      frozen
+      expansion { id name }
+      encounters { id name }
+      partitions { id name compactName default }
+    }
+  }
+}
+"""
+WORLD_METADATA_FORMAT = 1
+WORLD_METADATA_MAX_AGE = 7 * 86400
+WORLD = WorldMetadata()
+
+def load_world_metadata() -> None:
+    global WORLD
+    row = get_db().execute("SELECT format, version, fetched_at, zones FROM world_metadata WHERE id = 1").fetchone()
+    if row and row["format"] == WORLD_METADATA_FORMAT:
+        WORLD = WorldMetadata(json.loads(row["zones"]), row["version"], row["fetched_at"])
+
+async def refresh_world_metadata_now() -> None:
+    global WORLD
+    data = await fetch_fflogs_v2(WORLD_METADATA_QUERY, {})
+    zones = data["worldData"]["zones"] or []
+    encoded = json.dumps(zones, separators=(",", ":"), sort_keys=True)
+    version = hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:12]
+    now = time.time()
+    db = get_db()
+    with db:
+        if version == WORLD.version:
+            db.execute("UPDATE world_metadata SET fetched_at = ? WHERE id = 1", (now,))
+        else:
+            db.execute(
+                "INSERT OR REPLACE INTO world_metadata (id, format, version, fetched_at, zones) VALUES (1, ?, ?, ?, ?)",
+                (WORLD_METADATA_FORMAT, version, now, encoded)
+            )
+    if version == WORLD.version:
+        WORLD.fetched_at = now
+    else:
+        WORLD = WorldMetadata(zones, version, now)
+        print(f"🌐 World metadata updated ({len(WORLD.zones)} zones, version {version})")
+
+@tasks.loop(hours=12)
+async def refresh_world_metadata():
+    if time.time() - WORLD.fetched_at < WORLD_METADATA_MAX_AGE:
+        return
+    try:
+        await refresh_world_metadata_now()
+    except FFLogsError as e:
+        print("⚠️ World metadata refresh failed:", e)
+
+def metadata_choices(pairs) -> List[app_commands.Choice]:
+    return [app_commands.Choice(name=name[:100], value=value) for name, value in pairs]
 
 # === Add the paginator for embeds ===
 class EncounterPaginator(discord.ui.View):
@@ -100,6 +432,7 @@ class PanelConfig:
     role_ids: List[int]
     custom_id: str
     body: str = ""  # editable message text shown on the panel
+    stale: bool = False  # the panel message was deleted; kept until an admin removes the panel
 
 def load_all_panels() -> Dict[str, PanelConfig]:
     if not os.path.exists(DATA_FILE):
@@ -117,16 +450,205 @@ def save_all_panels(panels: Dict[str, PanelConfig]) -> None:
         json.dump(raw, f, indent=2)
 
 PANELS: Dict[str, PanelConfig] = {}
+# Members fetched for panel interactions when neither the payload nor the cache has them.
+# Short-lived: role state goes stale as soon as anyone edits the member.
+PANEL_MEMBER_CACHE = TTLCache(ttl=60, max_entries=512)
+
+async def resolve_panel_member(interaction: discord.Interaction) -> Optional[discord.Member]:
+    if isinstance(interaction.user, discord.Member):
+        return interaction.user
+    guild = interaction.guild
+    key = (guild.id, interaction.user.id)
+    member = guild.get_member(interaction.user.id) or PANEL_MEMBER_CACHE.get(key)
+    if member is None:
+        try:
+            member = await guild.fetch_member(interaction.user.id)
+        except discord.HTTPException:
+            return None
+        PANEL_MEMBER_CACHE.put(key, member)
+    return member
+
+# Resolved (role id -> name) per panel custom_id, so building a panel view and handling a toggle
+# never re-resolve roles. Role renames/deletions invalidate the affected panels and re-render them.
+PANEL_ROLE_CACHE: Dict[str, Dict[int, str]] = {}
+PANEL_REFRESH_DELAY = 5  # seconds; role edits arrive in bursts (reorders, bulk renames)
+dirty_panels: set = set()
+panel_refresh_task: Optional[asyncio.Task] = None
+
+def panel_roles(panel: PanelConfig, guild: discord.Guild) -> Dict[int, str]:
+    roles = PANEL_ROLE_CACHE.get(panel.custom_id)
+    if roles is None:
+        roles = {}
+        for rid in panel.role_ids:
+            role = guild.get_role(rid)
+            if role:
+                roles[rid] = role.name
+        PANEL_ROLE_CACHE[panel.custom_id] = roles
+    return roles
+
+def invalidate_panels(guild_id: int, role_id: int) -> None:
+    global panel_refresh_task
+    for key, panel in PANELS.items():
+        if panel.guild_id == guild_id and role_id in panel.role_ids:
+            PANEL_ROLE_CACHE.pop(panel.custom_id, None)
+            dirty_panels.add(key)
+    if dirty_panels and (panel_refresh_task is None or panel_refresh_task.done()):
+        panel_refresh_task = asyncio.create_task(refresh_dirty_panels())
+
+async def refresh_dirty_panels() -> None:
+    # Debounced: one message edit per affected panel, sent one after another
+    await asyncio.sleep(PANEL_REFRESH_DELAY)
+    while dirty_panels:
+        panel = PANELS.get(dirty_panels.pop())
+        guild = bot.get_guild(panel.guild_id) if panel else None
+        if guild is None:
+            continue
+        if panel.stale:
+            continue
+        view = RolePanelView(panel, guild)
+        bot.add_view(view)
+        await edit_panel_message(panel, view=view)
+
+def panel_message(panel: PanelConfig) -> discord.PartialMessage:
+    # Built from the stored ids, so editing costs one request and no fetch_channel/fetch_message
+    channel = bot.get_partial_messageable(panel.channel_id, guild_id=panel.guild_id)
+    return channel.get_partial_message(panel.message_id)
+
+async def edit_panel_message(panel: PanelConfig, **fields) -> bool:
+    # False when the edit didn't land; the panel is also marked stale if the message no longer exists
+    try:
+        await panel_message(panel).edit(**fields)
+    except discord.NotFound:
+        panel.stale = True
+        save_all_panels(PANELS)
+        return False
+    except discord.HTTPException as e:
+        print(f"⚠️ Could not edit panel {panel.message_id}: {e}")
+        return False
+    return True
+
+@bot.listen("on_guild_role_update")
+async def refresh_panels_on_role_update(before: discord.Role, after: discord.Role):
+    if before.name != after.name:
+        invalidate_panels(after.guild.id, after.id)
+
+@bot.listen("on_guild_role_delete")
+async def refresh_panels_on_role_delete(role: discord.Role):
+    invalidate_panels(role.guild.id, role.id)
+
+# Seconds of clock skew allowed between Discord's interaction timestamps and ours
+ROLE_SNAPSHOT_SLACK = 2.0
+
+class PendingRoleEdit:
+    __slots__ = ("member", "snapshot_at", "desired", "names", "interactions", "reason")
+
+    def __init__(self, member: discord.Member, reason: str):
+        self.member = member
+        self.snapshot_at = 0.0  # when Discord built `member` (the interaction's creation time)
+        self.desired: Dict[int, bool] = {}  # role id -> should the member have it
+        self.names: Dict[int, str] = {}
+        self.interactions: List[discord.Interaction] = []
+        self.reason = reason
+
+    def changes(self, member: discord.Member):
+        # (current role ids, ids to add, ids to remove) against the member's role list
+        current = {r.id for r in member.roles if not r.is_default()}
+        added = [rid for rid, want in self.desired.items() if want and rid not in current]
+        removed = [rid for rid, want in self.desired.items() if not want and rid in current]
+        return current, added, removed
+
+class RoleMutationQueue:
+    # One per guild. Toggles are coalesced per member into the final desired role set, and a
+    # single worker applies one member edit at a time, so panel launches queue up behind the
+    # guild's rate limit instead of bursting into 429s.
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self.pending: "OrderedDict[int, PendingRoleEdit]" = OrderedDict()
+        self.worker: Optional[asyncio.Task] = None
+        self.applied_at = TTLCache(ttl=600, max_entries=512)  # member id -> time of our last edit
+
+    def submit(self, member: discord.Member, roles: Dict[int, str], selected: set, interaction: discord.Interaction, reason: str):
+        edit = self.pending.get(member.id)
+        if edit is None:
+            edit = self.pending[member.id] = PendingRoleEdit(member, reason)
+        edit.member = member  # the newest payload has the freshest role list
+        edit.snapshot_at = interaction.created_at.timestamp()
+        edit.desired.update({rid: rid in selected for rid in roles})
+        edit.names.update(roles)
+        edit.interactions.append(interaction)
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.run())
+            background_tasks.add(self.worker)
+            self.worker.add_done_callback(background_tasks.discard)
+
+    async def run(self):
+        while self.pending:
+            _, edit = self.pending.popitem(last=False)
+            # A failing edit must not kill the worker: the members queued behind it still get applied
+            try:
+                message = await self.apply(edit)
+            except Exception as e:
+                print(f"❌ Role update for member {edit.member.id} failed: {e!r}")
+                message = "❌ Could not update your roles, please try again."
+            for interaction in edit.interactions:
+                try:
+                    await interaction.edit_original_response(content=message)
+                except Exception as e:
+                    print(f"⚠️ Could not answer role toggle {interaction.id}: {e}")
+
+    async def apply(self, edit: PendingRoleEdit) -> str:
+        # The payload's role list can miss roles changed since (by a moderator, another bot, or our own
+        # previous edit if it was still in flight), so it is never written back. One role goes through
+        # the per-role endpoint, which leaves every other role alone; several are written in one member
+        # edit built from a fresh read. A payload older than our last edit is re-read before diffing.
+        member = edit.member
+        applied_at = self.applied_at.get(member.id)
+        refetch = applied_at is not None and edit.snapshot_at <= applied_at + ROLE_SNAPSHOT_SLACK
+        try:
+            if refetch:
+                member = await self.guild.fetch_member(member.id)
+        except discord.HTTPException as e:
+            return f"❌ Could not update your roles: `{e}`"
+        _, added, removed = edit.changes(member)
+        if not added and not removed:
+            return "No changes."
+        try:
+            if len(added) + len(removed) == 1:
+                if added:
+                    await member.add_roles(discord.Object(added[0]), reason=edit.reason)
+                else:
+                    await member.remove_roles(discord.Object(removed[0]), reason=edit.reason)
+            else:
+                if not refetch:
+                    member = await self.guild.fetch_member(member.id)
+                current, added, removed = edit.changes(member)
+                if not added and not removed:
+                    return "No changes."
+                await member.edit(roles=[discord.Object(rid) for rid in (current - set(removed)) | set(added)], reason=edit.reason)
+            self.applied_at.put(member.id, time.time())
+        except discord.Forbidden:
+            return "❌ I don't have permission to change those roles."
+        except discord.HTTPException as e:
+            return f"❌ Could not update your roles: `{e}`"
+        finally:
+            PANEL_MEMBER_CACHE.pop((self.guild.id, member.id))
+        msg_bits = []
+        if added:
+            msg_bits.append(f"Added: {', '.join(edit.names[rid] for rid in added)}")
+        if removed:
+            msg_bits.append(f"Removed: {', '.join(edit.names[rid] for rid in removed)}")
+        return " • ".join(msg_bits)
+
+ROLE_QUEUES: Dict[int, RoleMutationQueue] = {}
 
 class RoleToggleSelect(discord.ui.Select):
     def __init__(self, panel: PanelConfig, guild: discord.Guild):
         self.panel = panel
         self.guild = guild
-        options = []
-        for rid in panel.role_ids:
-            role = guild.get_role(rid)
-            if role:
-                options.append(discord.SelectOption(label=role.name, value=str(role.id), description=f"Toggle {role.name}"))
+        options = [
+            discord.SelectOption(label=name, value=str(rid), description=f"Toggle {name}")
+            for rid, name in panel_roles(panel, guild).items()
+        ]
         if not options:
             options = [discord.SelectOption(label="No roles configured", value="none", description="Ask an admin to reconfigure")]
         super().__init__(
@@ -140,52 +662,76 @@ class RoleToggleSelect(discord.ui.Select):
     async def callback(self, interaction: discord.Interaction):
         if not self.panel.role_ids:
             return await interaction.response.send_message("This panel has no roles configured.", ephemeral=True)
-        member = interaction.user if isinstance(interaction.user, discord.Member) else interaction.guild.get_member(interaction.user.id)
-        if not isinstance(member, discord.Member):
-            return await interaction.response.send_message("Could not resolve your member object.", ephemeral=True)
+        # Acknowledge right away; the guild's queue applies the edit and updates this message
+        await interaction.response.send_message("⏳ Updating your roles…", ephemeral=True)
+        member = await resolve_panel_member(interaction)
+        if member is None:
+            return await interaction.edit_original_response(content="Could not resolve your member object.")
 
         selected_ids = set(int(v) for v in self.values) if self.values else set()
-        available_ids = set(self.panel.role_ids)
+        queue = ROLE_QUEUES.get(interaction.guild_id)
+        if queue is None:
+            queue = ROLE_QUEUES[interaction.guild_id] = RoleMutationQueue(interaction.guild)
+        queue.submit(member, panel_roles(self.panel, interaction.guild), selected_ids, interaction,
+                     f"Reaction roles panel {self.panel.message_id}")
 
-        to_add, to_remove = [], []
-        for rid in available_ids:
-            role = interaction.guild.get_role(rid)
-            if not role:
-                continue
-            if rid in selected_ids:
-                if role not in member.roles:
-                    to_add.append(role)
-            else:
-                if role in member.roles:
-                    to_remove.append(role)
+class RolePanelView(discord.ui.View):
+    def __init__(self, panel: PanelConfig, guild: discord.Guild):
+        super().__init__(timeout=None)
+        self.add_item(RoleToggleSelect(panel, guild))
+
+# ---------- Background jobs for admin flows ----------
+class JobRunner:
+    # Handlers defer first and enqueue the slow part (disk writes, REST calls); jobs run with
+    # bounded concurrency and report their returned message through the interaction followup.
+    # These are closures over live Discord objects that finish in seconds, so unlike AnalysisQueue
+    # jobs they are not stored in the database and are not resumed after a restart.
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.workers: List[asyncio.Task] = []
 
-        added_names, removed_names = [], []
-        reason = f"Reaction roles panel {self.panel.message_id}"
+    def submit(self, interaction: discord.Interaction, job: Callable[[], Awaitable[str]]) -> None:
+        self.queue.put_nowait((interaction, job))
+        if not self.workers:
+            self.workers = [asyncio.create_task(self.work()) for _ in range(self.concurrency)]
 
-        if to_add:
+    async def work(self):
+        while True:
+            interaction, job = await self.queue.get()
             try:
-                await member.add_roles(*to_add, reason=reason)
-                added_names = [r.name for r in to_add]
-            except discord.Forbidden:
-                pass
-        if to_remove:
+                message = await job()
+            except Exception as e:
+                print("❌ Background job error:", e)
+                message = f"❌ Something went wrong: `{e}`"
             try:
-                await member.remove_roles(*to_remove, reason=reason)
-                removed_names = [r.name for r in to_remove]
-            except discord.Forbidden:
+                await interaction.followup.send(message, ephemeral=True)
+            except discord.HTTPException:
                 pass
+            finally:
+                self.queue.task_done()
 
-        msg_bits = []
-        if added_names:
-            msg_bits.append(f"Added: {', '.join(added_names)}")
-        if removed_names:
-            msg_bits.append(f"Removed: {', '.join(removed_names)}")
-        await interaction.response.send_message(" • ".join(msg_bits) if msg_bits else "No changes.", ephemeral=True)
+PANEL_JOB_CONCURRENCY = 2
+panel_jobs = JobRunner(PANEL_JOB_CONCURRENCY)
 
-class RolePanelView(discord.ui.View):
-    def __init__(self, panel: PanelConfig, guild: discord.Guild):
-        super().__init__(timeout=None)
-        self.add_item(RoleToggleSelect(panel, guild))
+async def post_panel(panel_id: str, guild: discord.Guild, channel: discord.TextChannel,
+                     title: str, role_ids: List[int], body: str) -> PanelConfig:
+    # The custom_id is known up front, so the message goes out with its view in one request.
+    # The caller saves PANELS (once per batch for imports).
+    panel = PanelConfig(
+        guild_id=guild.id,
+        channel_id=channel.id,
+        message_id=0,
+        title=title,
+        role_ids=role_ids,
+        custom_id=f"rr_panel:{guild.id}:{panel_id}",
+        body=body
+    )
+    embed = discord.Embed(title=title, description=body, color=discord.Color.blurple())
+    msg = await channel.send(embed=embed, view=RolePanelView(panel, guild))
+    panel.message_id = msg.id
+    PANELS[panel_id] = panel
+    return panel
 
 # ---------- Setup (create) flow with editable message ----------
 class AdminRolePicker(discord.ui.View):
@@ -218,37 +764,16 @@ class PanelSetupMessageModal(discord.ui.Modal):
         self.add_item(self.body_input)
 
     async def on_submit(self, interaction: discord.Interaction):
-        body_text = (self.body_input.value or "").strip()
-        custom_id = f"rr_panel:{interaction.guild_id}:{self.parent.panel_id}"
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        panel_jobs.submit(interaction, lambda: self.create_panel(interaction))
 
-        # 1) Send the panel message first to obtain its message_id
-        embed = discord.Embed(
-            title=self.parent.title,
-            description=body_text,
-            color=discord.Color.blurple()
+    async def create_panel(self, interaction: discord.Interaction) -> str:
+        await post_panel(
+            self.parent.panel_id, interaction.guild, self.parent.channel,
+            self.parent.title, list(self.role_ids), (self.body_input.value or "").strip()
         )
-        msg = await self.parent.channel.send(embed=embed)
-
-        # 2) Save config
-        panel = PanelConfig(
-            guild_id=interaction.guild_id,
-            channel_id=self.parent.channel.id,
-            message_id=msg.id,
-            title=self.parent.title,
-            role_ids=list(self.role_ids),
-            custom_id=custom_id,
-            body=body_text
-        )
-        PANELS[self.parent.panel_id] = panel
         save_all_panels(PANELS)
-
-        # 3) Attach the interactive view
-        await msg.edit(view=RolePanelView(panel, interaction.guild))
-
-        await interaction.response.send_message(
-            content=f"✅ Panel created in {self.parent.channel.mention}.",
-            ephemeral=True
-        )
+        return f"✅ Panel created in {self.parent.channel.mention}."
 
 class _AdminRoleSelect(discord.ui.RoleSelect):
     def __init__(self, parent: AdminRolePicker):
@@ -266,12 +791,20 @@ class _AdminRoleSelect(discord.ui.RoleSelect):
         await interaction.response.send_modal(PanelSetupMessageModal(self.parent, role_ids))
 
 # ---------- Edit flow (roles and message) ----------
+STALE_PANEL_NOTE = "⚠️ The panel message no longer exists; the panel is marked stale. Remove it with `/rr_delete`."
+
+def panel_edit_note(panel: PanelConfig, edited: bool, done: str) -> str:
+    if edited:
+        return done
+    if panel.stale:
+        return STALE_PANEL_NOTE
+    return f"❌ Saved, but I couldn't edit the panel message in <#{panel.channel_id}>. Check my permissions there."
+
 class EditRolePicker(discord.ui.View):
-    def __init__(self, panel: PanelConfig, guild: discord.Guild, channel: discord.TextChannel):
+    def __init__(self, panel: PanelConfig, guild: discord.Guild):
         super().__init__(timeout=300)
         self.panel = panel
         self.guild = guild
-        self.channel = channel
         self.add_item(_EditRoleSelect(self))
 
     @discord.ui.button(label="Edit Message", style=discord.ButtonStyle.primary)
@@ -292,19 +825,18 @@ class _EditRoleSelect(discord.ui.RoleSelect):
         self.parent = parent
 
     async def callback(self, interaction: discord.Interaction):
-        roles = [r for r in self.values if isinstance(r, discord.Role)]
-        self.parent.panel.role_ids = [r.id for r in roles]
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        role_ids = [r.id for r in self.values if isinstance(r, discord.Role)]
+        panel_jobs.submit(interaction, lambda: self.update_roles(role_ids))
+
+    async def update_roles(self, role_ids: List[int]) -> str:
+        self.parent.panel.role_ids = role_ids
+        PANEL_ROLE_CACHE.pop(self.parent.panel.custom_id, None)
         save_all_panels(PANELS)
 
         # Update the existing message's view
-        channel = self.parent.guild.get_channel(self.parent.panel.channel_id) or await self.parent.guild.fetch_channel(self.parent.panel.channel_id)
-        try:
-            msg = await channel.fetch_message(self.parent.panel.message_id)
-            await msg.edit(view=RolePanelView(self.parent.panel, self.parent.guild))
-        except Exception:
-            pass
-
-        await interaction.response.send_message(content="✅ Roles updated for panel.", ephemeral=True)
+        edited = await edit_panel_message(self.parent.panel, view=RolePanelView(self.parent.panel, self.parent.guild))
+        return panel_edit_note(self.parent.panel, edited, "✅ Roles updated for panel.")
 
 class PanelEditMessageModal(discord.ui.Modal):
     def __init__(self, parent: EditRolePicker):
@@ -320,25 +852,21 @@ class PanelEditMessageModal(discord.ui.Modal):
         self.add_item(self.body_input)
 
     async def on_submit(self, interaction: discord.Interaction):
-        new_body = (self.body_input.value or "").strip()
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        panel_jobs.submit(interaction, lambda: self.update_body((self.body_input.value or "").strip()))
+
+    async def update_body(self, new_body: str) -> str:
         self.parent.panel.body = new_body
         save_all_panels(PANELS)
 
-        # Fetch and edit the original message's embed
-        channel = self.parent.guild.get_channel(self.parent.panel.channel_id) or await self.parent.guild.fetch_channel(self.parent.panel.channel_id)
-        try:
-            msg = await channel.fetch_message(self.parent.panel.message_id)
-            # Preserve title; update description
-            new_embed = discord.Embed(
-                title=self.parent.panel.title,
-                description=new_body,
-                color=discord.Color.blurple()
-            )
-            await msg.edit(embed=new_embed)
-        except Exception:
-            pass
-
-        await interaction.response.send_message(content="✅ Panel message updated.", ephemeral=True)
+        # Preserve title; update description
+        new_embed = discord.Embed(
+            title=self.parent.panel.title,
+            description=new_body,
+            color=discord.Color.blurple()
+        )
+        edited = await edit_panel_message(self.parent.panel, embed=new_embed)
+        return panel_edit_note(self.parent.panel, edited, "✅ Panel message updated.")
 
 @tree.command(name="rr_setup", description="Create a reaction-roles dropdown panel (admin only).")
 @app_commands.default_permissions(manage_guild=True)
@@ -364,8 +892,9 @@ async def rr_edit(interaction: discord.Interaction, message_id: str):
     if not target:
         return await interaction.response.send_message("Panel not found for this guild.", ephemeral=True)
 
-    ch = interaction.guild.get_channel(target.channel_id) or await interaction.guild.fetch_channel(target.channel_id)
-    view = EditRolePicker(target, interaction.guild, ch)
+    if target.stale:
+        return await interaction.response.send_message(STALE_PANEL_NOTE, ephemeral=True)
+    view = EditRolePicker(target, interaction.guild)
     await interaction.response.send_message("Use the controls below to edit this panel (roles or message):", view=view, ephemeral=True)
 
 @tree.command(name="rr_delete", description="Delete a reaction-roles panel (admin only).")
@@ -382,193 +911,836 @@ async def rr_delete(interaction: discord.Interaction, message_id: str):
     if not panel_key:
         return await interaction.response.send_message("Panel not found for this guild.", ephemeral=True)
     panel = PANELS.pop(panel_key)
+    PANEL_ROLE_CACHE.pop(panel.custom_id, None)
     save_all_panels(PANELS)
-    try:
-        ch = interaction.guild.get_channel(panel.channel_id) or await interaction.guild.fetch_channel(panel.channel_id)
-        m = await ch.fetch_message(panel.message_id)
-        await m.edit(view=None, content="(Reaction-roles panel removed by an admin.)")
-    except Exception:
-        pass
+    if not panel.stale:
+        try:
+            await panel_message(panel).edit(view=None, content="(Reaction-roles panel removed by an admin.)")
+        except discord.HTTPException:
+            pass
     await interaction.response.send_message("🗑️ Panel deleted.", ephemeral=True)
 
+# ---------- Export / import (YAML) ----------
+# Roles and channels are exported by name as well as id, so a file can provision another guild
+def export_panels(guild: discord.Guild) -> str:
+    panels = []
+    for panel in PANELS.values():
+        if panel.guild_id != guild.id or panel.stale:
+            continue
+        channel = guild.get_channel(panel.channel_id)
+        panels.append({
+            "title": panel.title,
+            "channel": channel.name if channel else panel.channel_id,
+            "body": panel.body,
+            "roles": list(panel_roles(panel, guild).values()),
+        })
+    return yaml.safe_dump({"panels": panels}, sort_keys=False, allow_unicode=True)
+
+def unassignable_reason(role: discord.Role) -> Optional[str]:
+    # Why the bot can't hand out this role from a panel, if it can't
+    if role.is_default():
+        return "@everyone can't be picked"
+    if role.managed:
+        return f"`{role.name}` is managed by an integration"
+    if not role.is_assignable():
+        return f"`{role.name}` is above my highest role"
+    return None
+
+def resolve_import_ref(ref, by_name: Dict[str, list], by_id: Callable[[int], object], kind: str):
+    # YAML turns unquoted numeric names into ints, so every ref is matched as a name first and only
+    # then as an id. Returns (match, error).
+    text = str(ref).strip()
+    matches = by_name.get(text.casefold(), [])
+    if len(matches) > 1:
+        return None, f"{kind} name `{text}` matches {len(matches)} {kind}s; use the id instead"
+    if matches:
+        return matches[0], None
+    found = by_id(int(text)) if text.isdigit() else None
+    return found, None if found else f"unknown {kind} `{text}`"
+
+def parse_panel_import(text: str, guild: discord.Guild):
+    # Validates the whole file first: returns ([(channel, title, role ids, body)], errors)
+    data = yaml.safe_load(text) or {}
+    entries = data.get("panels") if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError("Expected a top-level `panels:` list.")
+    roles_by_name: Dict[str, list] = {}
+    for r in guild.roles:
+        roles_by_name.setdefault(r.name.casefold(), []).append(r)
+    channels_by_name: Dict[str, list] = {}
+    for c in guild.text_channels:
+        channels_by_name.setdefault(c.name.casefold(), []).append(c)
+    parsed, errors = [], []
+    for i, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not entry.get("title"):
+            errors.append(f"#{i}: missing title")
+            continue
+        label = f"#{i} {entry['title']}"
+        channel_ref = str(entry.get("channel")).lstrip("#")
+        channel, problem = resolve_import_ref(channel_ref, channels_by_name, guild.get_channel, "channel")
+        if not isinstance(channel, discord.TextChannel):
+            errors.append(f"{label}: {problem or f'`{channel}` is not a text channel'}")
+            continue
+        refs = entry.get("roles")
+        if not isinstance(refs, list):
+            errors.append(f"{label}: `roles` must be a list")
+            continue
+        role_ids, problems = [], []
+        for ref in refs:
+            role, problem = resolve_import_ref(ref, roles_by_name, guild.get_role, "role")
+            problem = problem or unassignable_reason(role)
+            if problem:
+                problems.append(problem)
+            elif role.id not in role_ids:
+                role_ids.append(role.id)
+        if problems:
+            errors.extend(f"{label}: {problem}" for problem in problems)
+            continue
+        if not 1 <= len(role_ids) <= 25:
+            errors.append(f"{label}: needs 1–25 roles")
+            continue
+        parsed.append((channel, str(entry["title"]), role_ids, str(entry.get("body") or "")))
+    return parsed, errors
+
+async def import_panels(guild: discord.Guild, parsed) -> str:
+    # Channels have separate rate limit buckets: panels for one channel go out back to back,
+    # different channels in parallel
+    by_channel: Dict[int, list] = {}
+    for item in parsed:
+        by_channel.setdefault(item[0].id, []).append(item)
+
+    async def post_channel(items) -> List[str]:
+        failed = []
+        for channel, title, role_ids, body in items:
+            try:
+                await post_panel(f"{guild.id}-{os.urandom(4).hex()}", guild, channel, title, role_ids, body)
+            except discord.HTTPException as e:
+                failed.append(f"{title}: {e}")
+        return failed
+
+    failures = [f for batch in await asyncio.gather(*(post_channel(items) for items in by_channel.values())) for f in batch]
+    save_all_panels(PANELS)
+    message = f"✅ Created {len(parsed) - len(failures)} panel(s) in {len(by_channel)} channel(s)."
+    if failures:
+        message += "\n❌ Failed:\n" + "\n".join(failures)
+    return message[:2000]
+
+@tree.command(name="rr_export", description="Export this server's reaction-role panels as YAML (admin only).")
+@app_commands.default_permissions(manage_guild=True)
+async def rr_export(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.manage_guild:
+        return await interaction.response.send_message("You need Manage Server permission.", ephemeral=True)
+    text = export_panels(interaction.guild)
+    await interaction.response.send_message(
+        "📦 Reaction-role panels:",
+        file=discord.File(io.BytesIO(text.encode("utf-8")), filename=f"rr_panels_{interaction.guild_id}.yaml"),
+        ephemeral=True
+    )
+
+@tree.command(name="rr_import", description="Create reaction-role panels from a YAML export (admin only).")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(file="YAML file from /rr_export (roles and channels by name or id)")
+async def rr_import(interaction: discord.Interaction, file: discord.Attachment):
+    if not interaction.user.guild_permissions.manage_guild:
+        return await interaction.response.send_message("You need Manage Server permission.", ephemeral=True)
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        parsed, errors = parse_panel_import((await file.read()).decode("utf-8"), interaction.guild)
+    except (UnicodeDecodeError, yaml.YAMLError, ValueError) as e:
+        return await interaction.followup.send(f"❌ Could not read the file: `{e}`", ephemeral=True)
+    if errors:
+        # Nothing is created unless the whole file resolves
+        return await interaction.followup.send(("❌ Fix these entries and retry:\n" + "\n".join(errors))[:2000], ephemeral=True)
+    if not parsed:
+        return await interaction.followup.send("No panels in this file.", ephemeral=True)
+    panel_jobs.submit(interaction, lambda: import_panels(interaction.guild, parsed))
+
+# === Response memo ===
+# Heavy commands repeated with the same arguments in the same channel within a few minutes point
+# at the message already posted (and reuse its rendered embeds) instead of rebuilding it.
+RESPONSE_MEMO = TTLCache(ttl=600, max_entries=256)
+
+def memo_key(interaction: discord.Interaction, command: str, *args):
+    return (interaction.channel_id, command, *args)
+
+def remember_response(key, message, embeds: List[discord.Embed], encounter_names=None) -> None:
+    if message is not None:
+        RESPONSE_MEMO.put(key, (message.jump_url, time.time(), embeds, encounter_names))
+
+async def reply_from_memo(interaction: discord.Interaction, key) -> bool:
+    hit = RESPONSE_MEMO.get(key)
+    if hit is None:
+        return False
+    jump_url, posted_at, embeds, encounter_names = hit
+    minutes = int((time.time() - posted_at) // 60)
+    content = f"📌 Already posted here {minutes} min ago: {jump_url}\nRun it again with `refresh: True` to rebuild it."
+    if encounter_names:
+        await interaction.response.send_message(
+            content, embed=embeds[0], view=EncounterPaginator(embeds, encounter_names), ephemeral=True
+        )
+    else:
+        await interaction.response.send_message(content, embeds=embeds, ephemeral=True)
+    return True
+
 # === /logreport Command ===
+REPORT_FIGHT_FIELDS = "id name startTime endTime kill bossPercentage encounterID"
+# Fight ids only, to resolve "last N pulls" before fetching their rankings
+REPORT_FIGHT_IDS_QUERY = '''
+query($code: String!) {
+  reportData {
+    report(code: $code) {
+      fights(killType: Encounters) { id encounterID }
+    }
+  }
+}'''
+# Live reports keep growing, so entries go stale quickly but are still served while FFLogs is down
+REPORT_CACHE = TTLCache(ttl=300, stale_ttl=6 * 3600, max_entries=64)
+# A report with no new events for this long is finished. Its cached entries (e.g. from a link
+# prefetch) no longer go stale and answer /logreport for as long as they are kept.
+REPORT_SETTLED_AFTER = 30 * 60
+SETTLED_REPORTS = TTLCache(ttl=REPORT_CACHE.stale_ttl, max_entries=REPORT_CACHE.max_entries)
+
+def report_query(fight_ids: Optional[List[int]], encounter_id: Optional[int]) -> str:
+    # fights and rankings take the same fightIDs/encounterID arguments; unscoped reports omit them
+    params, args = ["$code: String!"], []
+    if fight_ids:
+        params.append("$fightIDs: [Int]")
+        args.append("fightIDs: $fightIDs")
+    if encounter_id:
+        params.append("$encounterID: Int")
+        args.append("encounterID: $encounterID")
+    scope = f"({', '.join(args)})" if args else ""
+    return (
+        f"query({', '.join(params)}) {{ reportData {{ report(code: $code) {{ startTime endTime "
+        f"fights{scope} {{ {REPORT_FIGHT_FIELDS} }} rankings{scope} }} }} }}"
+    )
+
+def report_cache_key(report_id: str, fight_ids: Optional[List[int]] = None, encounter_id: Optional[int] = None):
+    return (report_id, tuple(fight_ids or ()), encounter_id or 0) if fight_ids or encounter_id else report_id
+
+def cached_report(key):
+    # A fresh entry, or any entry still kept for a finished report
+    value = REPORT_CACHE.get(key)
+    if value is None and SETTLED_REPORTS.get(key if isinstance(key, str) else key[0]):
+        kept = REPORT_CACHE.get_stale(key)
+        value = kept[0] if kept else None
+    return value
+
+async def load_report(report_id: str, fight_ids: Optional[List[int]] = None, encounter_id: Optional[int] = None):
+    # Returns (fights, rankings, stale_age); stale_age is None unless FFLogs was unreachable.
+    # A cached full report also answers scoped requests (callers narrow it with scope_fights).
+    key = report_cache_key(report_id, fight_ids, encounter_id)
+    cached = cached_report(key) or cached_report(report_id)
+    if cached:
+        return (*cached, None)
+    variables = {"code": report_id}
+    if fight_ids:
+        variables["fightIDs"] = list(fight_ids)
+    if encounter_id:
+        variables["encounterID"] = encounter_id
+    try:
+        data = await fetch_fflogs_v2(report_query(fight_ids, encounter_id), variables)
+    except FFLogsUnavailable:
+        stale = REPORT_CACHE.get_stale(key) or REPORT_CACHE.get_stale(report_id)
+        if stale is None:
+            raise
+        (fights, rankings), age = stale
+        return fights, rankings, age
+    report = data["reportData"]["report"]
+    if report is None:
+        raise FFLogsError("Report not found or not public.")
+    record_fights(report_id, report["startTime"], report["fights"])
+    if time.time() * 1000 - (report.get("endTime") or 0) > REPORT_SETTLED_AFTER * 1000:
+        SETTLED_REPORTS.put(report_id, True)
+    fights = [Fight.from_api(f) for f in report["fights"]]
+    # Keep only the columns we render; the decoded rankings blob is released with `data`
+    rankings = project_rankings(report.get("rankings"))
+    del data, report
+    REPORT_CACHE.put(key, (fights, rankings))
+    return fights, rankings, None
+
+async def last_pull_ids(report_id: str, count: int, encounter_id: Optional[int] = None) -> List[int]:
+    cached = cached_report(report_id)
+    if cached:
+        fights = cached[0]
+    else:
+        data = await fetch_fflogs_v2(REPORT_FIGHT_IDS_QUERY, {"code": report_id})
+        report = data["reportData"]["report"]
+        if report is None:
+            raise FFLogsError("Report not found or not public.")
+        fights = [Fight(f["id"], f.get("encounterID") or 0, 0, 0, False, 100.0) for f in report["fights"]]
+    return [f.id for f in scope_fights(fights, encounter_id=encounter_id, last=count)]
+
+def build_report_embeds(report_id: str, fights, rankings):
+    # Names come from worldData first, so pulls without rankings (wipes, unranked fights) are named too
+    summaries = summarize_fights(fights, {**WORLD.encounter_names, **rankings.encounter_names})
+    encounter_names = {eid: enc.name for eid, enc in summaries.items()}
+    boss_embeds = []
+    for eid, enc in summaries.items():
+        summary = ""
+        for kill in enc.kills:
+            summary += f"🔥 **Kill** | Duration: {kill.duration}s\n"
+            parses = list(islice(rankings.rows(eid, kill.id), 8))
+            if parses:
+                summary += "```\n"
+                for p in parses:
+                    icon = ROLE_ICONS.get(p.role, "❔")
+                    percent = p.percent
+                    rank_emoji = (
+                        "🥇" if percent == 100 else
+                        "🏆" if percent >= 95 else
+                        "💜" if percent >= 75 else
+                        "💙" if percent >= 50 else
+                        "💚" if percent >= 25 else
+                        "🤌"
+                    )
+                    summary += f"{rank_emoji} {icon} {p.name}: {percent:.1f}%\n"
+                summary += "```\n"
+        if enc.wipes:
+            summary += f"**Wipes**\n"
+            for wipe in enc.wipes:
+                summary += f"💀 Boss HP: {wipe.boss_pct:.1f}% | Duration: {wipe.duration}s\n"
+        embed = discord.Embed(
+            title=f"{enc.name} – FFLogs Report: {report_id}",
+            description=summary[:4000],
+            color=0xB71C1C
+        )
+        embed.add_field(
+            name="🔗 View on Website",
+            value=f"[Open full report](https://www.fflogs.com/reports/{report_id})",
+            inline=False
+        )
+        boss_embeds.append(embed)
+    return boss_embeds, encounter_names
+
 @tree.command(name="logreport", description="Analyze a FFLogs report link")
-@app_commands.describe(link="The FFLogs report link (e.g. https://www.fflogs.com/reports/XXXXX)")
-async def logreport(interaction: discord.Interaction, link: str):
+@app_commands.describe(
+    link="The FFLogs report link (e.g. https://www.fflogs.com/reports/XXXXX, ?fight=Y is honoured)",
+    encounter="Only this encounter",
+    fight="Only this fight ID",
+    last="Only the last N boss pulls",
+    refresh="Rebuild even if this report was just posted here"
+)
+async def logreport(
+    interaction: discord.Interaction,
+    link: str,
+    encounter: Optional[int] = None,
+    fight: Optional[int] = None,
+    last: Optional[app_commands.Range[int, 1, 50]] = None,
+    refresh: bool = False,
+):
+    try:
+        report_id, selector = parse_report_link(link)
+    except ValueError as e:
+        return await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+    if fight is None and selector is not None:
+        if selector == "last":
+            last = last or 1
+        else:
+            fight = int(selector)
+    key = memo_key(interaction, "logreport", report_id, encounter, fight, last)
+    if refresh:
+        RESPONSE_MEMO.pop(key)
+        REPORT_CACHE.pop(report_id)
+    elif await reply_from_memo(interaction, key):
+        return
     await interaction.response.defer()
-    report_id = link.split("/")[-1].split("#")[0]
     try:
-        token = await get_fflogs_token()
-        headers = {"Authorization": f"Bearer {token}"}
-        query = '''
-        query($code: String!) {
-          reportData {
-            report(code: $code) {
-              fights {
-                id
-                startTime
-                endTime
-                kill
-                bossPercentage
-                encounterID
-              }
-              rankings
-            }
-          }
-        }
-        '''
-        variables = {"code": report_id}
-        response = await fetch_fflogs_v2(query, variables, headers)
-        report = response["data"]["reportData"]["report"]
-        fights = report["fights"]
+        fight_ids = [fight] if fight else None
+        if last and not fight_ids:
+            # Only the selected pulls' fights and rankings are downloaded
+            fight_ids = await last_pull_ids(report_id, last, encounter)
+            if not fight_ids:
+                return await interaction.followup.send("❌ No boss pulls found in this report.")
+        if refresh:
+            REPORT_CACHE.pop(report_cache_key(report_id, fight_ids, encounter))
+        fights, rankings, stale_age = await load_report(report_id, fight_ids, encounter)
+        fights = scope_fights(fights, fight_ids, encounter, last)
+        link_report(report_id, [interaction.guild_id])
+        boss_embeds, encounter_names = build_report_embeds(report_id, fights, rankings)
+        if not boss_embeds:
+            return await interaction.followup.send("❌ No boss pulls found in this report.")
+        message = await interaction.followup.send(
+            content=stale_note(stale_age) if stale_age is not None else None,
+            embed=boss_embeds[0],
+            view=EncounterPaginator(boss_embeds, encounter_names),
+            wait=True
+        )
+        if stale_age is None:
+            remember_response(key, message, boss_embeds, encounter_names)
+    except Exception as e:
+        await interaction.followup.send(f"❌ Error retrieving report: `{str(e)}`")
+
+@logreport.autocomplete("encounter")
+async def logreport_encounter_autocomplete(interaction: discord.Interaction, current: str):
+    return metadata_choices(WORLD.encounter_choices(current))
+
+# === Report link prefetch ===
+# Opted-in guilds: report links posted in chat are loaded into REPORT_CACHE ahead of /logreport,
+# one at a time and only while background spend stays under its share of the hourly budget.
+REPORT_LINK_RE = re.compile(r"fflogs\.com/reports/((?:a:)?[A-Za-z0-9]{16})")
+PREFETCH_DELAY = 3             # seconds between prefetches
+PREFETCH_PAUSE = 60            # seconds to wait while FFLogs is down or the budget is spent
+PREFETCH_MAX_PENDING = 20
+PREFETCH_BUDGET_CEILING = 0.3
+PREFETCH_REPORT_COST = 15.0    # estimated points per report query (no rateLimitData on it)
+prefetch_guilds: set = set()
+prefetch_queue: "OrderedDict[str, None]" = OrderedDict()
+prefetch_task: Optional[asyncio.Task] = None
+
+def load_prefetch_guilds() -> None:
+    prefetch_guilds.clear()
+    prefetch_guilds.update(
+        r["guild_id"] for r in get_db().execute("SELECT guild_id FROM guild_settings WHERE prefetch_links")
+    )
+
+@bot.listen("on_message")
+async def prefetch_report_links(message: discord.Message):
+    if message.guild is None or message.guild.id not in prefetch_guilds or message.author.bot:
+        return
+    if "fflogs.com/reports/" not in message.content:
+        return
+    global prefetch_task
+    for code in REPORT_LINK_RE.findall(message.content):
+        if code in prefetch_queue or cached_report(code) is not None:
+            continue
+        if len(prefetch_queue) >= PREFETCH_MAX_PENDING:
+            prefetch_queue.popitem(last=False)  # newest links are the likeliest to be asked for
+        prefetch_queue[code] = None
+    if prefetch_queue and (prefetch_task is None or prefetch_task.done()):
+        prefetch_task = asyncio.create_task(drain_prefetch_queue())
+
+async def drain_prefetch_queue():
+    while prefetch_queue:
+        await asyncio.sleep(PREFETCH_DELAY)
+        if not prefetch_queue:
+            return
+        if fflogs_breaker.state != "closed" or not fflogs_budget.allows(PREFETCH_REPORT_COST, PREFETCH_BUDGET_CEILING):
+            await asyncio.sleep(PREFETCH_PAUSE)  # low priority: hold the queue until commands leave room
+            continue
+        code, _ = prefetch_queue.popitem(last=False)
+        if cached_report(code) is not None:
+            continue
         try:
-            rankings_json = report.get("rankings", {})
-        except json.JSONDecodeError:
-            rankings_json = {}
-        encounter_names = {}
-        encounter_kills = {}
-        encounter_wipes = {}
-        parse_map = {}
-        for r in rankings_json.get("data", []):
-            enc = r.get("encounter", {})
-            eid = enc.get("id")
-            ename = enc.get("name", f"Encounter {eid}")
-            encounter_names[eid] = ename
-        for fight in fights:
-            eid = fight["encounterID"]
-            if eid == 0:
-                continue
-            if eid not in encounter_names:
-                encounter_names[eid] = f"Encounter {eid}"
-            if fight["kill"]:
-                encounter_kills.setdefault(eid, []).append(fight)
-            else:
-                encounter_wipes.setdefault(eid, []).append(fight)
-        for r in rankings_json.get("data", []):
-            eid = r.get("encounter", {}).get("id")
-            fid = r.get("fightID")
-            if eid is None or fid is None:
-                continue
-            roles = r.get("roles", {})
-            for role_type in ["tanks", "healers", "dps"]:
-                characters = roles.get(role_type, {}).get("characters", [])
-                for char in characters:
-                    if "name_2" in char:
-                        continue
-                    name = char.get("name")
-                    percent = char.get("rankPercent", 0)
-                    parse_map.setdefault((eid, fid), []).append({
-                        "name": name,
-                        "role": role_type,
-                        "percent": percent
-                    })
-        boss_embeds = []
-        for eid, ename in encounter_names.items():
-            if eid not in encounter_kills and eid not in encounter_wipes:
-                continue
-            summary = ""
-            for kill in encounter_kills.get(eid, []):
-                fid = kill["id"]
-                duration = (kill["endTime"] - kill["startTime"]) // 1000
-                summary += f"🔥 **Kill** | Duration: {duration}s\n"
-                parses = parse_map.get((eid, fid), [])[:8]
-                if parses:
-                    summary += "```\n"
-                    for p in parses:
-                        icon = {"tanks": "🛡️", "healers": "💖", "dps": "⚔️"}.get(p["role"], "❔")
-                        percent = p["percent"]
-                        rank_emoji = (
-                            "🥇" if percent == 100 else
-                            "🏆" if percent >= 95 else
-                            "💜" if percent >= 75 else
-                            "💙" if percent >= 50 else
-                            "💚" if percent >= 25 else
-                            "🤌"
-                        )
-                        summary += f"{rank_emoji} {icon} {p['name']}: {percent:.1f}%\n"
-                    summary += "```\n"
-            wipes = encounter_wipes.get(eid, [])
-            if wipes:
-                summary += f"**Wipes**\n"
-                for wipe in wipes:
-                    duration = (wipe["endTime"] - wipe["startTime"]) // 1000
-                    hp = wipe.get("bossPercentage", 100)
-                    summary += f"💀 Boss HP: {hp:.1f}% | Duration: {duration}s\n"
-            embed = discord.Embed(
-                title=f"{ename} – FFLogs Report: {report_id}",
-                description=summary[:4000],
-                color=0xB71C1C
-            )
-            embed.add_field(
-                name="🔗 View on Website",
-                value=f"[Open full report](https://www.fflogs.com/reports/{report_id})",
-                inline=False
+            await load_report(code)
+            fflogs_budget.record(PREFETCH_REPORT_COST)
+        except Exception as e:
+            print(f"⚠️ Prefetch of report {code} failed: {e}")
+
+@tree.command(name="prefetch_links", description="Preload FFLogs reports linked in chat so /logreport answers instantly (admin only).")
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(enabled="Turn link prefetching on or off for this server")
+async def prefetch_links(interaction: discord.Interaction, enabled: bool):
+    if not interaction.user.guild_permissions.manage_guild:
+        return await interaction.response.send_message("You need Manage Server permission.", ephemeral=True)
+    db = get_db()
+    with db:
+        db.execute(
+            "INSERT INTO guild_settings (guild_id, prefetch_links) VALUES (?, ?) "
+            "ON CONFLICT (guild_id) DO UPDATE SET prefetch_links = excluded.prefetch_links",
+            (interaction.guild_id, int(enabled))
+        )
+    if enabled:
+        prefetch_guilds.add(interaction.guild_id)
+    else:
+        prefetch_guilds.discard(interaction.guild_id)
+    note = ""
+    if enabled and not intents.message_content:
+        note = "\n⚠️ The message content intent is off (`message_content_intent` in config.json), so links cannot be seen yet."
+    await interaction.response.send_message(f"🔗 Link prefetching {'enabled' if enabled else 'disabled'}.{note}", ephemeral=True)
+
+# === /wipecounter Command ===
+WIPE_FIGHTS_QUERY = '''
+query($code: String!) {
+  reportData {
+    report(code: $code) {
+      startTime
+      fights(killType: Encounters) { id name encounterID startTime endTime kill bossPercentage }
+    }
+  }
+}'''
+wipe_sessions: Dict[str, WipeSession] = {}
+
+def wipe_scope(interaction: discord.Interaction, scope: str) -> str:
+    return f"user:{interaction.user.id}" if scope == "user" else f"channel:{interaction.channel_id}"
+
+def get_wipe_session(scope: str) -> WipeSession:
+    session = wipe_sessions.get(scope)
+    if session is None:
+        row = get_db().execute("SELECT state FROM wipe_sessions WHERE scope = ?", (scope,)).fetchone()
+        session = WipeSession.from_dict(json.loads(row["state"])) if row else WipeSession()
+        wipe_sessions[scope] = session
+    return session
+
+def save_wipe_session(scope: str, session: WipeSession):
+    db = get_db()
+    with db:
+        db.execute(
+            "INSERT INTO wipe_sessions (scope, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (scope) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (scope, json.dumps(session.to_dict(), separators=(",", ":")), time.time())
+        )
+
+def build_wipe_embed(title: str, session: WipeSession) -> discord.Embed:
+    embed = discord.Embed(title=title, color=0xB71C1C)
+    for tally in list(session.tallies.values())[:25]:
+        value = (
+            f"🔁 Pulls: **{tally.pulls}** | 🔥 Kills: **{tally.kills}** | 💀 Wipes: **{tally.wipes}** "
+            f"| Kill rate: **{tally.kill_rate:.0%}**\n"
+            f"🎯 Best: **{tally.best_pct:.1f}%** | ⏱️ Time: {tally.time // 60}m"
+        )
+        if tally.wipes:
+            value += (
+                f"\nWipe HP% `0 {sparkline(tally.wipe_pct_hist)} 100`"
+                f"\nWipe length `0m {sparkline(tally.wipe_duration_hist)} 15m+`"
             )
-            boss_embeds.append(embed)
+        embed.add_field(name=tally.name, value=value, inline=False)
+    embed.set_footer(text=f"{len(session.watermarks)} report(s) in this session")
+    return embed
+
+@tree.command(name="wipecounter", description="Track kills and wipes per encounter across FFLogs reports")
+@app_commands.describe(
+    link="FFLogs report to add (re-add a live report to count its new pulls)",
+    scope="Count for this channel (default) or just for you"
+)
+@app_commands.choices(scope=[
+    app_commands.Choice(name="channel", value="channel"),
+    app_commands.Choice(name="user", value="user"),
+])
+async def wipecounter(interaction: discord.Interaction, link: Optional[str] = None, scope: str = "channel"):
+    key = wipe_scope(interaction, scope)
+    session = get_wipe_session(key)
+    title = "☠️ Wipe counter – " + ("your session" if scope == "user" else "this channel")
+    if not link:
+        if not session.tallies:
+            return await interaction.response.send_message("No pulls counted yet. Add a report with `/wipecounter link:`.", ephemeral=True)
+        return await interaction.response.send_message(embed=build_wipe_embed(title, session))
+    try:
+        report_id, _ = parse_report_link(link)
+    except ValueError as e:
+        return await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+    await interaction.response.defer()
+    try:
+        data = await fetch_fflogs_v2(WIPE_FIGHTS_QUERY, {"code": report_id})
+        report = data["reportData"]["report"]
+        if report is None:
+            raise FFLogsError("Report not found or not public.")
+        fights = report["fights"] or []
+        record_fights(report_id, report["startTime"], fights, [interaction.guild_id])
+        names = {f["encounterID"]: f["name"] for f in fights if f.get("encounterID")}
+        added = session.feed(report_id, (Fight.from_api(f) for f in fights), names)
+        if added:
+            save_wipe_session(key, session)
         await interaction.followup.send(
-            embed=boss_embeds[0],
-            view=EncounterPaginator(boss_embeds, encounter_names)
+            content=f"➕ Counted {added} new pull(s) from `{report_id}`.",
+            embed=build_wipe_embed(title, session)
         )
     except Exception as e:
-        await interaction.followup.send(f"❌ Error retrieving report: `{str(e)}`")
+        print("❌ Wipe counter error:", e)
+        await interaction.followup.send(f"❌ Failed to update wipe counter:\n`{e}`")
+
+@tree.command(name="wipecounter_reset", description="Clear a wipe counter session")
+@app_commands.describe(scope="Reset this channel's session (default) or your own")
+@app_commands.choices(scope=[
+    app_commands.Choice(name="channel", value="channel"),
+    app_commands.Choice(name="user", value="user"),
+])
+async def wipecounter_reset(interaction: discord.Interaction, scope: str = "channel"):
+    key = wipe_scope(interaction, scope)
+    wipe_sessions.pop(key, None)
+    db = get_db()
+    with db:
+        db.execute("DELETE FROM wipe_sessions WHERE scope = ?", (key,))
+    await interaction.response.send_message("🧹 Wipe counter reset.", ephemeral=True)
+
+# === /progress Command ===
+PROGRESS_DEFAULT_DAYS = 28
+# Pulls logged by several people land in several reports; PROGRESS_PULLS_SQL counts them once.
+def progress_rows(guild_id: int, encounter_id: int, since_ms: int):
+    return get_db().execute(
+        PROGRESS_PULLS_SQL + """
+        SELECT date(start_at / 1000, 'unixepoch') AS day, COUNT(*) AS pulls, SUM(kill) AS kills,
+               MIN(CASE WHEN kill THEN 0 ELSE boss_pct END) AS best, SUM(duration) AS duration
+        FROM pulls WHERE start_at >= ? GROUP BY day ORDER BY day
+        """,
+        (guild_id, encounter_id, since_ms)
+    ).fetchall()
+
+def pulls_to_first_kill(guild_id: int, encounter_id: int):
+    # (pulls up to and including the first kill, killed?) over the whole stored history
+    row = get_db().execute(
+        PROGRESS_PULLS_SQL + """
+        SELECT COUNT(*) AS pulls, (SELECT MIN(start_at) FROM pulls WHERE kill) AS first_kill FROM pulls
+        WHERE start_at <= COALESCE((SELECT MIN(start_at) FROM pulls WHERE kill), start_at)
+        """,
+        (guild_id, encounter_id)
+    ).fetchone()
+    return row["pulls"], row["first_kill"] is not None
+
+async def progress_encounter_autocomplete(interaction: discord.Interaction, current: str):
+    rows = get_db().execute(
+        """SELECT DISTINCT f.encounter_id, f.encounter_name FROM fight_store f
+           JOIN report_guilds g ON g.report_code = f.report_code
+           WHERE g.guild_id = ? AND f.encounter_name LIKE ? ORDER BY f.encounter_name LIMIT 25""",
+        (interaction.guild_id, "%" + current.strip().replace("%", "") + "%")
+    ).fetchall()
+    return [app_commands.Choice(name=r["encounter_name"], value=str(r["encounter_id"])) for r in rows]
+
+@tree.command(name="progress", description="Progression per night for an encounter, from logs the bot has seen")
+@app_commands.guild_only()
+@app_commands.describe(encounter="Encounter (from reports fetched in this server)", days="How many days back (default 28)")
+async def progress(interaction: discord.Interaction, encounter: str, days: app_commands.Range[int, 1, 365] = PROGRESS_DEFAULT_DAYS):
+    db = get_db()
+    if encounter.isdigit():
+        row = db.execute("SELECT encounter_id, encounter_name FROM fight_store WHERE encounter_id = ? LIMIT 1", (int(encounter),)).fetchone()
+    else:
+        row = db.execute(
+            "SELECT encounter_id, encounter_name FROM fight_store WHERE encounter_name = ? COLLATE NOCASE LIMIT 1",
+            (encounter.strip(),)
+        ).fetchone()
+    if row is None:
+        return await interaction.response.send_message(
+            "❌ No stored pulls for that encounter. Logs are stored when fetched by `/logreport`, `/wipecounter` or the log watcher.",
+            ephemeral=True
+        )
+    encounter_id, name = row["encounter_id"], row["encounter_name"]
+    since_ms = int((time.time() - days * 86400) * 1000)
+    rows = progress_rows(interaction.guild_id, encounter_id, since_ms)
+    if not rows:
+        return await interaction.response.send_message(f"No pulls on **{name}** in the last {days} days.", ephemeral=True)
+    pulls, killed = pulls_to_first_kill(interaction.guild_id, encounter_id)
+    lines = [
+        f"`{r['day']}` 🔁 {r['pulls']} pulls | "
+        + (f"🔥 {r['kills']} kill(s)" if r["kills"] else f"🎯 best {r['best']:.1f}%")
+        + f" | ⏱️ {r['duration'] // 60000}m"
+        for r in rows[-25:]
+    ]
+    embed = discord.Embed(
+        title=f"📈 Progress – {name}",
+        description=(f"First kill after **{pulls}** pulls" if killed else f"Not killed yet – **{pulls}** pulls so far")
+        + "\n\n" + "\n".join(lines),
+        color=discord.Color.dark_purple()
+    )
+    embed.set_footer(text=f"Last {days} days · UTC days · from stored logs, no FFLogs calls")
+    await interaction.response.send_message(embed=embed)
+
+progress.autocomplete("encounter")(progress_encounter_autocomplete)
 
 # === /fflogs Command ===
-@tree.command(name="fflogs", description="Get FFLogs data for a FFXIV character")
-async def fflogs(
-    interaction: discord.Interaction,
-    character: str,
-    region: str = "EU"
-):
-    await interaction.response.defer()
+def character_query(zone: Optional[int] = None, partition: Optional[int] = None) -> str:
+    # zoneRankings defaults to the current zone; explicit zone/partition arguments only when asked for
+    params, args = ["$name: String!", "$server: String!", "$region: String!"], []
+    if zone:
+        params.append("$zone: Int")
+        args.append("zoneID: $zone")
+    if partition:
+        params.append("$partition: Int")
+        args.append("partition: $partition")
+    scope = f"({', '.join(args)})" if args else ""
+    return (
+        f"query({', '.join(params)}) {{ characterData {{ "
+        f"character(name: $name, serverSlug: $server, serverRegion: $region) {{ name server {{ name }} zoneRankings{scope} }} }} }}"
+    )
+
+CHARACTER_QUERY = character_query()
+class CharacterNotFound(FFLogsError):
+    pass
+
+# Popular characters get asked about all night: serve fresh hits directly, serve stale ones
+# while a single background refresh runs, and remember misses briefly so typos stay cheap.
+CHARACTER_CACHE = SWRCache(
+    ttl=600,
+    stale_ttl=12 * 3600,
+    negative_ttl=120,
+    negative_exceptions=(CharacterNotFound,),
+    max_entries=512
+)
+
+CHARACTER_BATCH_SIZE = 10
+CHARACTER_BATCH_FIELDS = "name server { name } zoneRankings"
+
+def parse_emoji(percent):
+    if percent is None:
+        return "Unkilled"
+    return (
+        "🥇" if percent == 100 else
+        "🏆" if percent >= 95 else
+        "💜" if percent >= 75 else
+        "💙" if percent >= 50 else
+        "💚" if percent >= 25 else
+        "🤌"
+    )
+
+def character_key(name: str, server: str, region: str):
+    return (name.strip().lower(), server.strip().lower(), region.strip().upper())
+
+def zone_cache_key(name: str, server: str, region: str, zone: Optional[int], partition: Optional[int]):
+    # Default-zone lookups share keys with the batched loaders; other zones get their own entries
+    key = character_key(name, server, region)
+    return (*key, zone or 0, partition or 0) if zone or partition else key
+
+async def fetch_character(name: str, server: str, region: str, zone: Optional[int] = None, partition: Optional[int] = None):
+    variables = {"name": name, "server": server, "region": region}
+    if zone:
+        variables["zone"] = zone
+    if partition:
+        variables["partition"] = partition
+    data = await fetch_fflogs_v2(character_query(zone, partition) if zone or partition else CHARACTER_QUERY, variables)
+    char = data["characterData"]["character"]
+    if char is None:
+        raise CharacterNotFound(f"Character {name} @ {server} ({region}) not found.")
+    return char
+
+async def load_character(name: str, server: str, region: str, zone: Optional[int] = None, partition: Optional[int] = None):
+    # Returns (character, age in seconds of the cached entry)
+    return await CHARACTER_CACHE.get(
+        zone_cache_key(name, server, region, zone, partition),
+        lambda: fetch_character(name, server, region, zone, partition)
+    )
+
+async def fetch_character_batch(chars):
+    # One aliased request for several characters; None where FFLogs has no such character
+    query = batch_character_query(len(chars), CHARACTER_BATCH_FIELDS, with_rate_limit=True)
+    data = await fetch_fflogs_v2(query, batch_character_variables(chars))
+    fflogs_budget.update(data.get("rateLimitData"))
+    return [data["characterData"].get(f"c{i}") for i in range(len(chars))]
+
+async def refresh_characters(chars):
+    # Fetch and store in CHARACTER_CACHE; returns {index: character or exception}
+    chunks = [range(i, min(i + CHARACTER_BATCH_SIZE, len(chars))) for i in range(0, len(chars), CHARACTER_BATCH_SIZE)]
+    outcomes = await asyncio.gather(
+        *(fetch_character_batch([chars[i] for i in chunk]) for chunk in chunks),
+        return_exceptions=True
+    )
+    results = {}
+    for chunk, outcome in zip(chunks, outcomes):
+        for pos, i in enumerate(chunk):
+            key = character_key(*chars[i])
+            if isinstance(outcome, Exception):
+                results[i] = outcome
+            elif outcome[pos] is None:
+                name, server, region = chars[i]
+                results[i] = CharacterNotFound(f"Character {name} @ {server} ({region}) not found.")
+                CHARACTER_CACHE.put_error(key, results[i])
+            else:
+                results[i] = outcome[pos]
+                CHARACTER_CACHE.put(key, outcome[pos])
+    return results
+
+async def load_characters(chars):
+    # Returns [(character or exception, age)] in input order. Fresh cache entries are reused and
+    # everything else is fetched together in aliased batches, so N characters cost about one
+    # request. If nothing is missing outright, stale entries are served and refreshed in the background.
+    results = [None] * len(chars)
+    missing, stale = [], []
+    for i, char in enumerate(chars):
+        try:
+            hit = CHARACTER_CACHE.lookup(character_key(*char))
+        except CharacterNotFound as e:
+            results[i] = (e, 0.0)
+            continue
+        if hit is None:
+            missing.append(i)
+            continue
+        results[i] = hit
+        if hit[1] > CHARACTER_CACHE.ttl:
+            stale.append(i)
+    if not missing:
+        if stale:
+            task = asyncio.create_task(refresh_characters([chars[i] for i in stale]))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        return results
+    todo = missing + stale
+    fetched = await refresh_characters([chars[i] for i in todo])
+    for pos, i in enumerate(todo):
+        value = fetched[pos]
+        if results[i] is not None and isinstance(value, Exception) and not isinstance(value, CharacterNotFound):
+            continue  # refresh failed; keep serving the stale entry
+        results[i] = (value, 0.0)
+    return results
+
+# Autocomplete sources: every known world plus characters looked up (or registered) so far
+WORLD_INDEX = PrefixIndex(world for world, _ in WORLD_REGIONS.values())
+CHARACTER_INDEX = PrefixIndex()
+
+# Regions learned from FFLogs for worlds missing from WORLDS_BY_REGION
+LEARNED_WORLD_REGIONS: Dict[str, str] = {}
+# Characters on unlisted worlds that FFLogs had in no region; kept longer than CHARACTER_CACHE misses
+UNLISTED_MISSES = TTLCache(ttl=3600, max_entries=512)
+
+def resolve_character_arg(character: str, region: Optional[str] = None):
+    # "Name Surname@Server" -> (name, server, region). Known worlds always use their own region and
+    # near-misses of them are rejected locally; other worlds use the region passed or learned
+    # earlier, else None (look it up on FFLogs).
     try:
-        full_name, server = character.split("@")
-        first_name, last_name = full_name.strip().split(" ", 1)
-        name = f"{first_name} {last_name}"
+        name, server = parse_character(character)
     except ValueError:
-        await interaction.followup.send("❌ Please format character as `Name Surname@Server`.")
-        return
+        raise ValueError("Please format character as `Name Surname@Server`.")
+    world = find_world(server)
+    if world:
+        return (name, *world)
+    if region:
+        return name, server, region.strip().upper()
+    learned = LEARNED_WORLD_REGIONS.get(server.casefold())
+    if learned is None:
+        hint = close_worlds(server)
+        if hint:
+            raise ValueError(f"Unknown server `{server}`. Did you mean: {', '.join(hint)}?")
+    return name, server, learned
+
+async def locate_character_region(name: str, server: str) -> str:
+    # One batched request across the regions without a world list; hits and misses land in
+    # CHARACTER_CACHE, so the follow-up lookup is free, and misses are remembered for an hour
+    key = (name.casefold(), server.casefold())
+    if UNLISTED_MISSES.get(key):
+        raise ValueError(f"`{name} @ {server}` was not found on FFLogs. Pass a region if the server is right.")
+    results = await load_characters([(name, server, region) for region in UNLISTED_REGIONS])
+    for region, (value, _) in zip(UNLISTED_REGIONS, results):
+        if not isinstance(value, Exception):
+            LEARNED_WORLD_REGIONS[server.casefold()] = region
+            return region
+    for value, _ in results:
+        if not isinstance(value, CharacterNotFound):
+            raise value
+    UNLISTED_MISSES.put(key, True)
+    raise ValueError(f"`{name} @ {server}` was not found on FFLogs. Pass a region if the server is right.")
+
+async def resolve_characters(interaction: discord.Interaction, characters: List[str],
+                             region: Optional[str] = None, ephemeral: bool = False):
+    # resolve_character_arg for each one; if a region has to be looked up, the interaction is
+    # deferred first, so callers reply through interaction_send()
+    resolved = [resolve_character_arg(c, region) for c in characters]
+    unknown = [i for i, (_, _, r) in enumerate(resolved) if r is None]
+    if unknown:
+        await interaction.response.defer(ephemeral=ephemeral)
+        regions = await asyncio.gather(*(locate_character_region(*resolved[i][:2]) for i in unknown))
+        for i, found in zip(unknown, regions):
+            resolved[i] = (*resolved[i][:2], found)
+    return resolved
+
+def interaction_send(interaction: discord.Interaction):
+    return interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
+
+async def respond_with_character(interaction: discord.Interaction, name: str, server: str, region: str,
+                                 zone: Optional[int] = None, partition: Optional[int] = None):
+    # Cached characters are answered in the initial response; only misses pay for defer + followup
+    if not interaction.response.is_done() and CHARACTER_CACHE.peek(zone_cache_key(name, server, region, zone, partition)) is None:
+        await interaction.response.defer()
+    send = interaction_send(interaction)
     try:
-        await get_fflogs_token()
-        query = """
-        query($name: String!, $server: String!, $region: String!) {
-          characterData {
-            character(name: $name, serverSlug: $server, serverRegion: $region) {
-              name
-              server { name }
-              zoneRankings
-            }
-          }
-        }
-        """
-        variables = {"name": name, "server": server, "region": region}
-        headers = {"Authorization": f"Bearer {access_token}"}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://www.fflogs.com/api/v2/client",
-                json={"query": query, "variables": variables},
-                headers=headers
-            ) as resp:
-                data = await resp.json()
-        char = data["data"]["characterData"]["character"]
+        char, age = await load_character(name, server, region, zone, partition)
+        CHARACTER_INDEX.add(f"{char['name']}@{char['server']['name']}")
         rankings = char["zoneRankings"]["rankings"]
         encoded_name = quote(char["name"])
         profile_url = f"https://www.fflogs.com/character/{region}/{char['server']['name']}/{encoded_name}"
+        zone_name = WORLD.zones.get(zone, {}).get("name") if zone else None
         embed = discord.Embed(
             title=f"FFLogs for {char['name']} @ {char['server']['name']} ({region})",
-            description=f"[View on FFLogs]({profile_url})",
+            description=f"[View on FFLogs]({profile_url})" + (f" • {zone_name}" if zone_name else ""),
             color=discord.Color.dark_purple()
         )
-        def parse_emoji(percent):
-            if percent is None:
-                return "Unkilled"
-            return (
-                "🥇" if percent == 100 else
-                "🏆" if percent >= 95 else
-                "💜" if percent >= 75 else
-                "💙" if percent >= 50 else
-                "💚" if percent >= 25 else
-                "🤌"
-            )
         for log in rankings[:5]:
             percent = log.get('rankPercent')
             emoji = parse_emoji(percent)
@@ -580,93 +1752,1029 @@ async def fflogs(
                 value=f"{emoji} Rank: **{percent_display}** | 🗡️ Kills: `{kills}`",
                 inline=False
             )
-        await interaction.followup.send(embed=embed)
+        if age > CHARACTER_CACHE.ttl:
+            embed.set_footer(text=f"Cached {int(age // 60)} min ago • refreshing in the background")
+        await send(embed=embed)
     except Exception as e:
         print("❌ Log fetch error:", e)
-        await interaction.followup.send(f"❌ Failed to retrieve logs:\n`{e}`")
+        await send(f"❌ Failed to retrieve logs:\n`{e}`")
 
-# === /dancepartner Command ===
-@tree.command(name="dancepartner", description="Suggest the best Dance Partner based on a FFLogs report.", guild=discord.Object(id=GUILD_ID))
-@app_commands.describe(link="The FFLogs report link (e.g. https://www.fflogs.com/reports/XXXXX?fight=Y)")
-async def dancepartner(interaction: discord.Interaction, link: str):
+@tree.command(name="fflogs", description="Get FFLogs data for a FFXIV character")
+@app_commands.describe(
+    character="Name Surname@Server",
+    region="Region, only for servers the bot doesn't know (e.g. CN/KR); known servers use their own",
+    zone="Zone to show (defaults to the current raid tier)",
+    partition="Zone partition (e.g. a patch or echo split)"
+)
+async def fflogs(
+    interaction: discord.Interaction,
+    character: str,
+    region: Optional[str] = None,
+    zone: Optional[int] = None,
+    partition: Optional[int] = None
+):
+    try:
+        [(name, server, region)] = await resolve_characters(interaction, [character], region)
+    except (ValueError, FFLogsError) as e:
+        await interaction_send(interaction)(f"❌ {e}", ephemeral=True)
+        return
+    await respond_with_character(interaction, name, server, region, zone, partition)
+
+@fflogs.autocomplete("character")
+async def fflogs_character_autocomplete(interaction: discord.Interaction, current: str):
+    # Served purely from memory to stay inside Discord's 3s autocomplete window
+    region = (interaction.namespace.region or "").upper()
+    if "@" in current:
+        name, _, server = current.partition("@")
+        worlds = [w for w in WORLD_INDEX.search(server.strip()) if not region or WORLD_REGIONS[w.casefold()][1] == region]
+        suggestions = [f"{name.strip()}@{w}" for w in worlds]
+    else:
+        suggestions = CHARACTER_INDEX.search(current.strip())
+    return [app_commands.Choice(name=v[:100], value=v[:100]) for v in suggestions[:25]]
+
+@fflogs.autocomplete("region")
+async def fflogs_region_autocomplete(interaction: discord.Interaction, current: str):
+    return [app_commands.Choice(name=r, value=r) for r in REGIONS if r.startswith(current.strip().upper())]
+
+@fflogs.autocomplete("zone")
+async def fflogs_zone_autocomplete(interaction: discord.Interaction, current: str):
+    return metadata_choices(WORLD.zone_choices(str(current)))
+
+@fflogs.autocomplete("partition")
+async def fflogs_partition_autocomplete(interaction: discord.Interaction, current: str):
+    return metadata_choices(WORLD.partition_choices(interaction.namespace.zone, str(current)))
+
+# === /compare Command ===
+@tree.command(name="compare", description="Compare two characters' FFLogs rankings side by side")
+@app_commands.describe(first="Name Surname@Server", second="Name Surname@Server")
+async def compare(interaction: discord.Interaction, first: str, second: str):
+    try:
+        chars = await resolve_characters(interaction, [first, second])
+    except (ValueError, FFLogsError) as e:
+        return await interaction_send(interaction)(f"❌ {e}", ephemeral=True)
+    if not interaction.response.is_done():
+        await interaction.response.defer()
+    try:
+        results = await load_characters(chars)
+        for value, _ in results:
+            if isinstance(value, Exception):
+                raise value
+        loaded = [value for value, _ in results]
+        for char in loaded:
+            CHARACTER_INDEX.add(f"{char['name']}@{char['server']['name']}")
+        aligned = align_encounters([(char.get("zoneRankings") or {}).get("rankings") or [] for char in loaded])
+        embed = discord.Embed(
+            title=" vs ".join(f"{c['name']} @ {c['server']['name']}" for c in loaded),
+            color=discord.Color.dark_purple()
+        )
+        for encounter, row in aligned[:25]:
+            percents = [(log or {}).get("rankPercent") for log in row]
+            best = max((p for p in percents if p is not None), default=None)
+            lines = []
+            for char, log, percent in zip(loaded, row, percents):
+                crown = " 👑" if best is not None and percent == best else ""
+                percent_display = f"{percent:.2f}%" if percent is not None else "N/A"
+                kills = (log or {}).get("totalKills", 0)
+                lines.append(f"{parse_emoji(percent)} **{char['name']}**: {percent_display} | 🗡️ Kills: `{kills}`{crown}")
+            embed.add_field(name=encounter, value="\n".join(lines), inline=False)
+        if not aligned:
+            embed.description = "No ranked encounters for either character."
+        await interaction.followup.send(embed=embed)
+    except Exception as e:
+        print("❌ Compare error:", e)
+        await interaction.followup.send(f"❌ Failed to compare characters:\n`{e}`")
+
+compare.autocomplete("first")(fflogs_character_autocomplete)
+compare.autocomplete("second")(fflogs_character_autocomplete)
+
+# === /static Commands ===
+STATIC_MAX_MEMBERS = 24
+
+def get_static_members(guild_id: int, name: str):
+    return [
+        (r["name"], r["server"], r["region"])
+        for r in get_db().execute(
+            """SELECT m.name, m.server, m.region FROM static_members m
+               JOIN static_rosters s ON s.id = m.roster_id
+               WHERE s.guild_id = ? AND s.name = ? ORDER BY m.position""",
+            (guild_id, name.strip().lower())
+        )
+    ]
+
+def save_static(guild_id: int, name: str, members) -> None:
+    db = get_db()
+    key = name.strip().lower()
+    with db:
+        db.execute("INSERT OR IGNORE INTO static_rosters (guild_id, name) VALUES (?, ?)", (guild_id, key))
+        roster_id = db.execute("SELECT id FROM static_rosters WHERE guild_id = ? AND name = ?", (guild_id, key)).fetchone()["id"]
+        db.execute("DELETE FROM static_members WHERE roster_id = ?", (roster_id,))
+        db.executemany(
+            "INSERT INTO static_members (roster_id, position, name, server, region) VALUES (?, ?, ?, ?, ?)",
+            [(roster_id, pos, *member) for pos, member in enumerate(members)]
+        )
+
+async def static_name_autocomplete(interaction: discord.Interaction, current: str):
+    rows = get_db().execute(
+        "SELECT name FROM static_rosters WHERE guild_id = ? AND name LIKE ? ORDER BY name LIMIT 25",
+        (interaction.guild_id, current.strip().lower().replace("%", "") + "%")
+    ).fetchall()
+    return [app_commands.Choice(name=r["name"], value=r["name"]) for r in rows]
+
+@tree.command(name="static_set", description="Save a static roster (comma-separated Name Surname@Server list)")
+@app_commands.guild_only()
+@app_commands.describe(name="Roster name", members="e.g. Aa Bb@Odin, Cc Dd@Twintania, …")
+async def static_set(interaction: discord.Interaction, name: str, members: str):
+    entries = [m for m in members.replace(";", ",").split(",") if m.strip()]
+    if not entries or len(entries) > STATIC_MAX_MEMBERS:
+        return await interaction.response.send_message(f"❌ A roster needs 1–{STATIC_MAX_MEMBERS} characters.", ephemeral=True)
+    try:
+        roster = await resolve_characters(interaction, entries, ephemeral=True)
+    except (ValueError, FFLogsError) as e:
+        return await interaction_send(interaction)(f"❌ {e}", ephemeral=True)
+    save_static(interaction.guild_id, name, roster)
+    for member in roster:
+        CHARACTER_INDEX.add(f"{member[0]}@{member[1]}")
+    await interaction_send(interaction)(f"✅ Saved static **{name.strip().lower()}** with {len(roster)} members.", ephemeral=True)
+
+@tree.command(name="static_delete", description="Delete a saved static roster")
+@app_commands.guild_only()
+@app_commands.describe(name="Roster name")
+@app_commands.autocomplete(name=static_name_autocomplete)
+async def static_delete(interaction: discord.Interaction, name: str):
+    db = get_db()
+    with db:
+        cur = db.execute("DELETE FROM static_rosters WHERE guild_id = ? AND name = ?", (interaction.guild_id, name.strip().lower()))
+    msg = "🗑️ Static deleted." if cur.rowcount else "Static not found for this server."
+    await interaction.response.send_message(msg, ephemeral=True)
+
+@tree.command(name="static", description="Rankings report for a whole saved static roster")
+@app_commands.guild_only()
+@app_commands.describe(name="Roster name")
+@app_commands.autocomplete(name=static_name_autocomplete)
+async def static(interaction: discord.Interaction, name: str):
+    members = get_static_members(interaction.guild_id, name)
+    if not members:
+        return await interaction.response.send_message("Static not found for this server. Use `/static_set`.", ephemeral=True)
     await interaction.response.defer()
     try:
-        parsed = urlparse(link)
-        report_id = parsed.path.split("/")[-1]
-        fight_id = int(parse_qs(parsed.query).get("fight", [0])[0])
+        # Whole roster in one batched request (cached members cost nothing)
+        results = await load_characters(members)
+        loaded, missing = [], []
+        for (member_name, server, _), (value, _) in zip(members, results):
+            if isinstance(value, CharacterNotFound):
+                missing.append(f"{member_name} @ {server}")
+            elif isinstance(value, Exception):
+                raise value
+            else:
+                loaded.append(value)
+        aligned = align_encounters([(c.get("zoneRankings") or {}).get("rankings") or [] for c in loaded])
+        embed = discord.Embed(
+            title=f"Static report: {name.strip().lower()} ({len(loaded)}/{len(members)} players)",
+            color=discord.Color.dark_purple()
+        )
+        for encounter, row in aligned[:25]:
+            parses = [(log.get("rankPercent"), char["name"]) for char, log in zip(loaded, row) if log and log.get("rankPercent") is not None]
+            if not parses:
+                embed.add_field(name=encounter, value="Unkilled", inline=False)
+                continue
+            best, best_name = max(parses)
+            med = median(p for p, _ in parses)
+            embed.add_field(
+                name=encounter,
+                value=(
+                    f"{parse_emoji(best)} Best: **{best:.1f}%** ({best_name}) | "
+                    f"{parse_emoji(med)} Median: **{med:.1f}%** | 🗡️ Cleared: `{len(parses)}/{len(loaded)}`"
+                ),
+                inline=False
+            )
+        if missing:
+            embed.description = "Not found on FFLogs: " + ", ".join(missing)
+        elif not aligned:
+            embed.description = "No ranked encounters for this roster."
+        await interaction.followup.send(embed=embed)
     except Exception as e:
-        await interaction.followup.send(f"❌ Invalid FFLogs link format: `{e}`")
+        print("❌ Static report error:", e)
+        await interaction.followup.send(f"❌ Failed to build static report:\n`{e}`")
+
+# === /mylogs Command ===
+WARM_ACTIVE_WINDOW = 24 * 3600  # warm mains of users who ran a command in the last 24h
+WARM_QUIET_THRESHOLD = 5        # commands in the last 10 minutes above which warming waits
+WARM_BUDGET_CEILING = 0.4       # warming only spends while the hour is under 40% used
+WARM_MAX_BATCHES_PER_TICK = 3
+WARM_BATCH_COST = 20.0          # rough points per zoneRankings batch
+recent_commands = deque()         # monotonic timestamps of recent slash commands
+pending_activity: Dict[int, float] = {}  # user_id -> unix time, flushed to SQLite by the warmer
+
+@bot.listen("on_interaction")
+async def track_command_activity(interaction: discord.Interaction):
+    if interaction.type is discord.InteractionType.application_command:
+        recent_commands.append(time.monotonic())
+        pending_activity[interaction.user.id] = time.time()
+
+def get_main_character(user_id: int):
+    row = get_db().execute("SELECT name, server, region FROM main_characters WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        # Fall back to the user's most recently active registered character
+        row = get_db().execute(
+            """SELECT w.name, w.server, w.region FROM character_subscriptions s
+               JOIN watched_characters w ON w.id = s.character_id
+               WHERE s.user_id = ? ORDER BY w.last_activity DESC LIMIT 1""",
+            (user_id,)
+        ).fetchone()
+    return (row["name"], row["server"], row["region"]) if row else None
+
+@tree.command(name="setmain", description="Save your main character for /mylogs")
+@app_commands.describe(character="Name Surname@Server")
+async def setmain(interaction: discord.Interaction, character: str):
+    try:
+        [(name, server, region)] = await resolve_characters(interaction, [character], ephemeral=True)
+    except (ValueError, FFLogsError) as e:
+        return await interaction_send(interaction)(f"❌ {e}", ephemeral=True)
+    db = get_db()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO main_characters (user_id, name, server, region) VALUES (?, ?, ?, ?)",
+            (interaction.user.id, name, server, region)
+        )
+    CHARACTER_INDEX.add(f"{name}@{server}")
+    await interaction_send(interaction)(f"✅ Main character set to **{name} @ {server}** ({region}).", ephemeral=True)
+
+@tree.command(name="mylogs", description="FFLogs data for your saved main character")
+async def mylogs(interaction: discord.Interaction):
+    main = get_main_character(interaction.user.id)
+    if main is None:
+        return await interaction.response.send_message(
+            "You have no main character yet. Set one with `/setmain Name Surname@Server`.",
+            ephemeral=True
+        )
+    await respond_with_character(interaction, *main)
+
+setmain.autocomplete("character")(fflogs_character_autocomplete)
+
+def flush_activity() -> None:
+    if not pending_activity:
+        return
+    db = get_db()
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO user_activity (user_id, last_command_at) VALUES (?, ?)",
+            list(pending_activity.items())
+        )
+    pending_activity.clear()
+
+@tasks.loop(minutes=10)
+async def warm_character_cache():
+    # Keep recently active users' mains fresh so /mylogs is answered from memory.
+    flush_activity()
+    cutoff = time.monotonic() - 600
+    while recent_commands and recent_commands[0] < cutoff:
+        recent_commands.popleft()
+    if len(recent_commands) > WARM_QUIET_THRESHOLD:
         return
+    rows = get_db().execute(
+        """SELECT DISTINCT m.name, m.server, m.region FROM main_characters m
+           JOIN user_activity a ON a.user_id = m.user_id
+           WHERE a.last_command_at >= ?""",
+        (time.time() - WARM_ACTIVE_WINDOW,)
+    ).fetchall()
+    due = []
+    for row in rows:
+        char = (row["name"], row["server"], row["region"])
+        hit = CHARACTER_CACHE.peek(character_key(*char))
+        # Refresh a bit before expiry so the next /mylogs still finds a fresh entry
+        if hit is None or hit[1] > CHARACTER_CACHE.ttl * 0.5:
+            due.append(char)
+    for i in range(0, min(len(due), WARM_MAX_BATCHES_PER_TICK * CHARACTER_BATCH_SIZE), CHARACTER_BATCH_SIZE):
+        if fflogs_breaker.state != "closed" or not fflogs_budget.allows(WARM_BATCH_COST, WARM_BUDGET_CEILING):
+            return
+        # refresh_characters reports failures per character instead of raising; a missing
+        # character is a normal outcome, anything else means FFLogs is struggling
+        results = await refresh_characters(due[i:i + CHARACTER_BATCH_SIZE])
+        failure = next(
+            (v for v in results.values() if isinstance(v, Exception) and not isinstance(v, CharacterNotFound)), None
+        )
+        if failure is not None:
+            print("❌ Cache warm error:", failure)
+            return
+
+@warm_character_cache.before_loop
+async def before_warm_character_cache():
+    await bot.wait_until_ready()
+
+# =========================
+# Recent Logs Watcher
+# =========================
+WATCH_BATCH_SIZE = 25            # characters per aliased GraphQL request
+WATCH_MAX_BATCHES_PER_TICK = 2   # hard cap: at most 120 watcher requests per hour
+WATCH_BUDGET_CEILING = 0.5       # background work may only push hourly spend up to 50%
+WATCH_ALERT_COOLDOWN = 15 * 60   # per subscription, to avoid spamming a channel
+WATCH_MISS_BACKOFF = 30 * 60     # first retry after FFLogs can't find a character; doubles per miss
+WATCH_MISS_MAX_INTERVAL = 24 * 3600
+WATCH_QUERY_FIELDS = (
+    "recentReports(limit: 5) { data { code title startTime zone { name } "
+    "fights(killType: Encounters) { id name encounterID startTime endTime kill bossPercentage } } }"
+)
+watch_batch_cost = 10.0  # points per batch, learned from rateLimitData deltas
+
+def find_watched(name: str, server: str, region: Optional[str] = None):
+    # Names and servers match case-insensitively, so "foo bar@odin" is the same watch as "Foo Bar@Odin"
+    return get_db().execute(
+        """SELECT * FROM watched_characters WHERE name = ? COLLATE NOCASE AND server = ? COLLATE NOCASE
+           AND (? IS NULL OR region = ?)""",
+        (name, server, region, region)
+    ).fetchall()
+
+def watch_character(name: str, server: str, region: str, guild_id: int, user_id: int, channel_id: int) -> None:
+    db = get_db()
+    with db:
+        rows = find_watched(name, server, region)
+        if rows:
+            row = rows[0]
+        else:
+            db.execute("INSERT INTO watched_characters (name, server, region) VALUES (?, ?, ?)", (name, server, region))
+            row = find_watched(name, server, region)[0]
+        # A new subscriber hears about reports uploaded from now on, not the ones already seen
+        db.execute(
+            """INSERT OR REPLACE INTO character_subscriptions (character_id, guild_id, user_id, channel_id, alerted_start)
+               VALUES (?, ?, ?, ?, ?)""",
+            (row["id"], guild_id, user_id, channel_id, row["last_report_start"])
+        )
+
+def unwatch_character(name: str, server: str, region: Optional[str], guild_id: int, user_id: int) -> bool:
+    db = get_db()
+    with db:
+        ids = [r["id"] for r in find_watched(name, server, region)]
+        cur = db.execute(
+            f"""DELETE FROM character_subscriptions WHERE guild_id = ? AND user_id = ?
+                AND character_id IN ({", ".join("?" * len(ids))})""",
+            (guild_id, user_id, *ids)
+        )
+        # Characters nobody subscribes to any more stop costing polls
+        db.execute("DELETE FROM watched_characters WHERE id NOT IN (SELECT character_id FROM character_subscriptions)")
+    return cur.rowcount > 0
+
+async def poll_watch_batch(rows) -> None:
+    global watch_batch_cost
+    chars = [(r["name"], r["server"], r["region"]) for r in rows]
+    query = batch_character_query(len(chars), WATCH_QUERY_FIELDS, with_rate_limit=True)
+    spent_before = fflogs_budget.spent
+    data = await fetch_fflogs_v2(query, batch_character_variables(chars))
+    fflogs_budget.update(data.get("rateLimitData"))
+    if fflogs_budget.spent > spent_before:
+        watch_batch_cost = 0.7 * watch_batch_cost + 0.3 * (fflogs_budget.spent - spent_before)
+    now = time.time()
+    db = get_db()
+    for i, row in enumerate(rows):
+        char = data["characterData"].get(f"c{i}")
+        if char is None:
+            # Renamed, transferred or hidden: poll less and less often instead of every cycle
+            misses = row["misses"] + 1
+            with db:
+                db.execute(
+                    "UPDATE watched_characters SET misses = ?, next_poll_at = ? WHERE id = ?",
+                    (misses, now + min(WATCH_MISS_BACKOFF * 2 ** (misses - 1), WATCH_MISS_MAX_INTERVAL), row["id"])
+                )
+            continue
+        reports = (char.get("recentReports") or {}).get("data") or []
+        if reports:
+            # Live reports grow between polls; the store keeps only pulls it has not seen
+            guild_ids = [r["guild_id"] for r in db.execute(
+                "SELECT DISTINCT guild_id FROM character_subscriptions WHERE character_id = ?", (row["id"],)
+            )]
+            for report in reports:
+                record_fights(report["code"], report["startTime"], report.get("fights") or [], guild_ids)
+        reports = sorted(reports, key=lambda r: r["startTime"])
+        last_start, last_code, last_activity = row["last_report_start"], row["last_report_code"], row["last_activity"]
+        if reports and reports[-1]["startTime"] > last_start:
+            last_start, last_code = reports[-1]["startTime"], reports[-1]["code"]
+            last_activity = last_start / 1000
+        if row["initialized"]:
+            # Each subscription has its own marker, so reports held back by a cooldown go out later
+            await send_watch_alerts(row, reports)
+        with db:
+            if not row["initialized"]:
+                # The first poll only sets the watermarks; old reports are not news
+                db.execute("UPDATE character_subscriptions SET alerted_start = ? WHERE character_id = ?", (last_start, row["id"]))
+            db.execute(
+                """UPDATE watched_characters SET last_report_start = ?, last_report_code = ?, last_activity = ?,
+                   next_poll_at = ?, initialized = 1, misses = 0 WHERE id = ?""",
+                (last_start, last_code, last_activity, now + watch_interval(now - last_activity), row["id"])
+            )
+
+async def send_watch_alerts(row, reports) -> None:
+    db = get_db()
+    now = time.time()
+    subs = db.execute(
+        "SELECT guild_id, user_id, channel_id, last_alert_at, alerted_start FROM character_subscriptions WHERE character_id = ?",
+        (row["id"],)
+    ).fetchall()
+    for sub in subs:
+        # Reports are only marked as announced once the alert went out
+        unseen = [r for r in reports if r["startTime"] > sub["alerted_start"]]
+        if not unseen or now - sub["last_alert_at"] < WATCH_ALERT_COOLDOWN:
+            continue
+        channel = bot.get_channel(sub["channel_id"])
+        if channel is None:
+            continue
+        lines = [
+            f"[{r.get('title') or r['code']}](https://www.fflogs.com/reports/{r['code']})"
+            + (f" – {r['zone']['name']}" if r.get("zone") else "")
+            for r in unseen[-5:]
+        ]
+        embed = discord.Embed(
+            title=f"📜 New logs for {row['name']} @ {row['server']}",
+            description="\n".join(lines),
+            color=discord.Color.dark_purple()
+        )
+        try:
+            await channel.send(embed=embed)
+        except discord.HTTPException:
+            continue
+        with db:
+            db.execute(
+                """UPDATE character_subscriptions SET last_alert_at = ?, alerted_start = ?
+                   WHERE character_id = ? AND guild_id = ? AND user_id = ?""",
+                (now, unseen[-1]["startTime"], row["id"], sub["guild_id"], sub["user_id"])
+            )
+
+@tasks.loop(seconds=60)
+async def recent_logs_watcher():
+    # Due characters are polled most-recently-active first, WATCH_BATCH_SIZE per request,
+    # and only while the shared hourly point budget leaves room for interactive commands.
+    for _ in range(WATCH_MAX_BATCHES_PER_TICK):
+        if not fflogs_budget.allows(watch_batch_cost, WATCH_BUDGET_CEILING):
+            return
+        rows = get_db().execute(
+            "SELECT * FROM watched_characters WHERE next_poll_at <= ? ORDER BY last_activity DESC LIMIT ?",
+            (time.time(), WATCH_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        try:
+            await poll_watch_batch(rows)
+        except FFLogsError as e:
+            print("❌ Recent logs watcher error:", e)
+            return
+
+@recent_logs_watcher.before_loop
+async def before_recent_logs_watcher():
+    await bot.wait_until_ready()
+
+@tree.command(name="addcharacter", description="Register a character and get alerts for its new FFLogs reports")
+@app_commands.guild_only()
+@app_commands.describe(character="Name Surname@Server", channel="Channel for new-log alerts (defaults to this one)")
+async def addcharacter(interaction: discord.Interaction, character: str, channel: Optional[discord.TextChannel] = None):
     try:
-        token = await get_fflogs_token()
-        headers = {"Authorization": f"Bearer {token}"}
-        query = '''
-        query($code: String!, $fight: Int!) {
-          reportData {
-            report(code: $code) {
-              table(dataType: DamageDone, fightIDs: [$fight])
-            }
-          }
-        }'''
-        variables = {"code": report_id, "fight": fight_id}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://www.fflogs.com/api/v2/client",
-                json={"query": query, "variables": variables},
-                headers=headers
-            ) as resp:
-                raw = await resp.json()
-        if "errors" in raw:
-            raise ValueError(raw["errors"][0]["message"])
-        table_raw = raw["data"]["reportData"]["report"]["table"]
-        if not table_raw:
-            raise ValueError("Table data is empty or missing.")
-        data = table_raw
-        entries = data.get("entries", [])
-        total_time = data.get("totalTime", 0) / 1000
-        if not entries or total_time == 0:
-            raise ValueError("No combat entries or invalid duration.")
-    except Exception as e:
-        print("❌ Dance Partner error:", e)
-        await interaction.followup.send(f"❌ Dance Partner error: Unable to parse entries from FFLogs table\n`{e}`")
+        [(name, server, region)] = await resolve_characters(interaction, [character], ephemeral=True)
+    except (ValueError, FFLogsError) as e:
+        return await interaction_send(interaction)(f"❌ {e}", ephemeral=True)
+    target = channel or interaction.channel
+    watch_character(name, server, region, interaction.guild_id, interaction.user.id, target.id)
+    CHARACTER_INDEX.add(f"{name}@{server}")
+    await interaction_send(interaction)(
+        f"✅ Watching **{name} @ {server}** ({region}); new logs will be posted in {target.mention}.",
+        ephemeral=True
+    )
+
+@tree.command(name="removecharacter", description="Stop watching one of your registered characters")
+@app_commands.guild_only()
+@app_commands.describe(character="Name Surname@Server")
+async def removecharacter(interaction: discord.Interaction, character: str):
+    try:
+        # No FFLogs lookup to remove: a world with no known region matches the character in any region
+        name, server, region = resolve_character_arg(character)
+    except ValueError as e:
+        return await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+    if unwatch_character(name, server, region, interaction.guild_id, interaction.user.id):
+        await interaction.response.send_message(f"🗑️ No longer watching **{name} @ {server}**.", ephemeral=True)
+    else:
+        await interaction.response.send_message("That character is not registered to you here.", ephemeral=True)
+
+@tree.command(name="characters", description="List your registered characters")
+@app_commands.guild_only()
+async def characters(interaction: discord.Interaction):
+    rows = get_db().execute(
+        """SELECT w.name, w.server, w.region, w.last_report_code, w.misses, s.channel_id
+           FROM character_subscriptions s JOIN watched_characters w ON w.id = s.character_id
+           WHERE s.guild_id = ? AND s.user_id = ? ORDER BY w.name""",
+        (interaction.guild_id, interaction.user.id)
+    ).fetchall()
+    if not rows:
+        return await interaction.response.send_message("You have no registered characters. Use `/addcharacter`.", ephemeral=True)
+    lines = [
+        f"• **{r['name']} @ {r['server']}** ({r['region']}) → <#{r['channel_id']}>"
+        + (f" • last log `{r['last_report_code']}`" if r["last_report_code"] else "")
+        + (" • ⚠️ not found on FFLogs, checked less often" if r["misses"] else "")
+        for r in rows
+    ]
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+addcharacter.autocomplete("character")(fflogs_character_autocomplete)
+removecharacter.autocomplete("character")(fflogs_character_autocomplete)
+
+# === Analysis job queue ===
+# Long analyses (e.g. /dancepartner over every kill of a report) are stored in analysis_jobs and run
+# by worker tasks instead of the command coroutine. The command posts a followup that the job keeps
+# editing with its progress and finally its result; a restart requeues running jobs, which resume
+# from their checkpoint.
+ANALYSIS_WORKERS = 2
+ANALYSIS_PROGRESS_INTERVAL = 5  # seconds between progress edits
+ANALYSIS_JOB_RETENTION = 7 * 24 * 3600
+ANALYSIS_CLAIM_RETRY = 30  # seconds a worker waits after the database failed to hand out a job
+INTERACTION_EDIT_WINDOW = 14 * 60  # interaction tokens expire after 15 minutes
+ANALYSIS_JOB_HANDLERS: Dict[str, Callable[["AnalysisJob"], Awaitable[dict]]] = {}
+
+def analysis_job(kind: str):
+    def register(handler):
+        ANALYSIS_JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+@dataclass
+class AnalysisJob:
+    id: int
+    kind: str
+    args: dict
+    checkpoint: dict
+    guild_id: Optional[int]
+    channel_id: int
+    message_id: int
+    user_id: int
+    last_edit: float = 0.0
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "AnalysisJob":
+        return cls(row["id"], row["kind"], json.loads(row["args"]), json.loads(row["checkpoint"]),
+                   row["guild_id"], row["channel_id"], row["message_id"], row["user_id"])
+
+class AnalysisQueue:
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.wakeup = asyncio.Event()
+        self.workers: List[asyncio.Task] = []
+        self.running: Dict[int, asyncio.Task] = {}
+        self.cancelling: set = set()
+        # Followups are edited through the interaction while its token is valid, else as a channel message
+        self.interactions: Dict[int, discord.Interaction] = {}
+
+    def start(self) -> int:
+        # Jobs left running by the previous process go back to the queue; returns how many
+        if self.workers:
+            return 0
+        db = get_db()
+        now = time.time()
+        with db:
+            resumed = db.execute(
+                "UPDATE analysis_jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (now,)
+            ).rowcount
+            db.execute(
+                "DELETE FROM analysis_jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (now - ANALYSIS_JOB_RETENTION,)
+            )
+        self.workers = [asyncio.create_task(self.work()) for _ in range(self.concurrency)]
+        return resumed
+
+    def submit(self, kind: str, args: dict, interaction: discord.Interaction, message: discord.Message,
+               resume: bool = True) -> int:
+        # With `resume`, the job picks up the parts a failed run with the same arguments already finished
+        now = time.time()
+        encoded = json.dumps(args, sort_keys=True)
+        db = get_db()
+        failed = resume and db.execute(
+            "SELECT checkpoint FROM analysis_jobs WHERE kind = ? AND args = ? AND status = 'failed' ORDER BY id DESC LIMIT 1",
+            (kind, encoded)
+        ).fetchone()
+        with db:
+            job_id = db.execute(
+                "INSERT INTO analysis_jobs (kind, args, checkpoint, guild_id, channel_id, message_id, user_id, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, encoded, failed["checkpoint"] if failed else "{}", interaction.guild_id, message.channel.id,
+                 message.id, interaction.user.id, now, now)
+            ).lastrowid
+        self.interactions[job_id] = interaction
+        self.wakeup.set()
+        return job_id
+
+    def claim(self) -> Optional[AnalysisJob]:
+        # No await between the read and the update, so two workers never claim the same job.
+        # A row that can't be decoded is marked failed and skipped instead of being handed out again.
+        db = get_db()
+        while True:
+            row = db.execute("SELECT * FROM analysis_jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            with db:
+                db.execute("UPDATE analysis_jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row["id"]))
+            try:
+                return AnalysisJob.from_row(row)
+            except Exception as e:
+                print(f"❌ Analysis job #{row['id']} is unreadable:", e)
+                with db:
+                    db.execute(
+                        "UPDATE analysis_jobs SET status = 'failed', progress = ?, updated_at = ? WHERE id = ?",
+                        (f"Unreadable job: {e}", time.time(), row["id"])
+                    )
+
+    async def work(self):
+        while True:
+            try:
+                job = self.claim()
+            except sqlite3.Error as e:
+                # The worker outlives a locked or failing database; it retries after a pause
+                print("❌ Could not claim an analysis job:", e)
+                await asyncio.sleep(ANALYSIS_CLAIM_RETRY)
+                continue
+            if job is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            task = asyncio.create_task(self.run(job))
+            self.running[job.id] = task
+            try:
+                await task
+            finally:
+                self.running.pop(job.id, None)
+                self.interactions.pop(job.id, None)
+                self.cancelling.discard(job.id)
+
+    async def run(self, job: AnalysisJob):
+        try:
+            handler = ANALYSIS_JOB_HANDLERS.get(job.kind)
+            if handler is None:
+                raise ValueError(f"Unknown job kind '{job.kind}'")
+            fields = await handler(job)
+        except asyncio.CancelledError:
+            if job.id not in self.cancelling:
+                raise  # shutting down: the job stays 'running' and is requeued on the next start
+            self.finish(job, "cancelled", "Cancelled.")
+            await self.edit(job, content=f"🛑 Job #{job.id} was cancelled.")
+        except Exception as e:
+            print(f"❌ Analysis job #{job.id} ({job.kind}) failed:", e)
+            self.finish(job, "failed", str(e))
+            await self.edit(job, content=f"❌ Job #{job.id} failed: `{e}`\nFinished parts are kept; run the command again to continue.")
+        else:
+            self.finish(job, "done", "")
+            await self.edit(job, **fields)
+
+    def finish(self, job: AnalysisJob, status: str, progress: str) -> None:
+        # A failed job keeps its checkpoint for the next submission with the same arguments
+        db = get_db()
+        with db:
+            db.execute(
+                "UPDATE analysis_jobs SET status = ?, progress = ?, updated_at = ?, "
+                "checkpoint = CASE WHEN ? = 'failed' THEN checkpoint ELSE '{}' END WHERE id = ?",
+                (status, progress, time.time(), status, job.id)
+            )
+
+    async def progress(self, job: AnalysisJob, text: str) -> None:
+        # Saves the checkpoint with every step; the followup is edited at most every few seconds
+        db = get_db()
+        with db:
+            db.execute(
+                "UPDATE analysis_jobs SET progress = ?, checkpoint = ?, updated_at = ? WHERE id = ?",
+                (text, json.dumps(job.checkpoint, separators=(",", ":")), time.time(), job.id)
+            )
+        if time.monotonic() - job.last_edit >= ANALYSIS_PROGRESS_INTERVAL:
+            job.last_edit = time.monotonic()
+            await self.edit(job, content=f"⏳ Job #{job.id}: {text}")
+
+    async def edit(self, job: AnalysisJob, **fields) -> None:
+        interaction = self.interactions.get(job.id)
+        try:
+            if interaction and time.time() - interaction.created_at.timestamp() < INTERACTION_EDIT_WINDOW:
+                await interaction.followup.edit_message(job.message_id, **fields)
+            else:
+                channel = bot.get_partial_messageable(job.channel_id, guild_id=job.guild_id)
+                await channel.get_partial_message(job.message_id).edit(**fields)
+        except discord.HTTPException as e:
+            print(f"⚠️ Could not update job #{job.id} message: {e}")
+
+    async def cancel(self, job_id: int) -> bool:
+        db = get_db()
+        with db:
+            queued = db.execute(
+                "UPDATE analysis_jobs SET status = 'cancelled', progress = 'Cancelled.', updated_at = ? "
+                "WHERE id = ? AND status = 'queued'", (time.time(), job_id)
+            ).rowcount
+        if queued:
+            row = db.execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+            await self.edit(AnalysisJob.from_row(row), content=f"🛑 Job #{job_id} was cancelled.")
+            self.interactions.pop(job_id, None)
+            return True
+        task = self.running.get(job_id)
+        if task is None:
+            return False
+        self.cancelling.add(job_id)
+        task.cancel()
+        return True
+
+analysis_jobs = AnalysisQueue(ANALYSIS_WORKERS)
+
+@tree.command(name="jobs", description="List queued and running analyses in this server.")
+async def jobs_command(interaction: discord.Interaction):
+    rows = get_db().execute(
+        "SELECT id, kind, status, progress, user_id, created_at FROM analysis_jobs "
+        "WHERE guild_id IS ? AND status IN ('queued', 'running') ORDER BY id",
+        (interaction.guild_id,)
+    ).fetchall()
+    if not rows:
+        await interaction.response.send_message("No analyses are queued or running.", ephemeral=True)
+        return
+    lines = [
+        f"**#{r['id']}** {r['kind']} · {r['status']}{' · ' + r['progress'] if r['progress'] else ''} "
+        f"· <@{r['user_id']}> <t:{int(r['created_at'])}:R>"
+        for r in rows
+    ]
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+@tree.command(name="job_cancel", description="Cancel a queued or running analysis.")
+@app_commands.describe(job_id="The job number shown in its progress message or in /jobs")
+async def job_cancel(interaction: discord.Interaction, job_id: int):
+    row = get_db().execute(
+        "SELECT user_id, guild_id, status FROM analysis_jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+    if row is None or row["guild_id"] != interaction.guild_id:
+        await interaction.response.send_message(f"❌ Job #{job_id} not found.", ephemeral=True)
         return
-    buff_names = ["Standard Finish", "Devilment", "Technical Finish"]
-    results = []
-    for player in entries:
-        name = player.get("name")
-        job = player.get("type")
-        taken = player.get("taken", [])
-        buffs = {b["name"]: b["total"] for b in taken if b["name"] in buff_names}
-        total = sum(buffs.values())
-        rdps = round(total / total_time, 2) if total_time else 0
-        results.append({
-            "name": name,
-            "job": job,
-            "standard": buffs.get("Standard Finish", 0),
-            "devilment": buffs.get("Devilment", 0),
-            "esprit": buffs.get("Technical Finish", 0),
-            "total": total,
-            "rdps": rdps
+    is_admin = interaction.guild is not None and interaction.user.guild_permissions.manage_guild
+    if row["user_id"] != interaction.user.id and not is_admin:
+        await interaction.response.send_message("❌ Only the job's owner or a server manager can cancel it.", ephemeral=True)
+        return
+    if row["status"] not in ("queued", "running") or not await analysis_jobs.cancel(job_id):
+        await interaction.response.send_message(f"Job #{job_id} has already finished ({row['status']}).", ephemeral=True)
+        return
+    await interaction.response.send_message(f"🛑 Cancelling job #{job_id}.", ephemeral=True)
+
+# === /dancepartner Command ===
+PARTNER_REPORT_QUERY = '''
+query($code: String!) {
+  reportData {
+    report(code: $code) {
+      fights { id encounterID startTime endTime kill friendlyPlayers }
+      masterData {
+        abilities { gameID name }
+        players: actors(type: "Player") { id name subType }
+        pets: actors(type: "Pet") { id petOwner }
+      }
+    }
+  }
+}'''
+EVENTS_QUERY = '''
+query($code: String!, $fight: Int!, $start: Float!, $end: Float!, $filter: String!) {
+  reportData {
+    report(code: $code) {
+      events(fightIDs: [$fight], startTime: $start, endTime: $end, filterExpression: $filter, limit: 10000) {
+        data
+        nextPageTimestamp
+      }
+    }
+  }
+}'''
+# Only the dancer buffs and friendly damage are needed; everything else stays server-side.
+# The buffs are streamed first so the damage pages can be attributed against complete windows.
+PARTNER_BUFF_FILTER = (
+    'type in ("applybuff", "removebuff") and ability.name in ('
+    + ", ".join(f'"{name}"' for name in PARTNER_BUFFS)
+    + ')'
+)
+PARTNER_DAMAGE_FILTER = 'type = "damage" and source.disposition = "friendly"'
+
+async def iter_report_pages(report_id: str, fight_id: int, start: float, end: float, filter_expr: str):
+    # Pages through report.events via nextPageTimestamp; only one page is held at a time
+    while start is not None:
+        data = await fetch_fflogs_v2(EVENTS_QUERY, {
+            "code": report_id, "fight": fight_id, "start": start, "end": end, "filter": filter_expr
         })
-    results = sorted(results, key=lambda r: r["rdps"], reverse=True)
-    top = results[0]["rdps"] if results else 0
+        page = data["reportData"]["report"]["events"]
+        yield page.get("data") or []
+        start = page.get("nextPageTimestamp")
+
+async def iter_report_events(report_id: str, fight_id: int, start: float, end: float, filter_expr: str):
+    async for page in iter_report_pages(report_id, fight_id, start, end, filter_expr):
+        for event in page:
+            yield event
+
+# Report metadata is short-lived (live logs gain fights); a finished fight's gains never change
+PARTNER_REPORT_CACHE = TTLCache(ttl=600, max_entries=32)
+PARTNER_FIGHT_CACHE = TTLCache(ttl=24 * 3600, max_entries=256)
+# (report, fight) -> the running computation, shared by everyone asking for it meanwhile
+PARTNER_IN_FLIGHT: Dict[tuple, "asyncio.Future"] = {}
+PARTNER_CONCURRENCY = 3
+partner_semaphore = asyncio.Semaphore(PARTNER_CONCURRENCY)
+
+@dataclass
+class PartnerReport:
+    fights: Dict[int, dict]
+    buff_columns: Dict[int, str]
+    owners: Dict[int, int]
+    players: Dict[int, tuple]
+
+async def load_partner_report(report_id: str) -> PartnerReport:
+    cached = PARTNER_REPORT_CACHE.get(report_id)
+    if cached:
+        return cached
+    data = await fetch_fflogs_v2(PARTNER_REPORT_QUERY, {"code": report_id})
+    report = data["reportData"]["report"]
+    if report is None:
+        raise ValueError("Report not found or not public.")
+    master = report["masterData"]
+    meta = PartnerReport(
+        fights={f["id"]: f for f in report["fights"] or []},
+        buff_columns={
+            a["gameID"]: PARTNER_BUFFS[a["name"]][0]
+            for a in master.get("abilities") or [] if a.get("name") in PARTNER_BUFFS
+        },
+        owners={p["id"]: p["petOwner"] for p in master.get("pets") or [] if p.get("petOwner")},
+        players={p["id"]: (p["name"], p.get("subType") or "?") for p in master.get("players") or []},
+    )
+    PARTNER_REPORT_CACHE.put(report_id, meta)
+    return meta
+
+async def compute_fight_partner(report_id: str, meta: PartnerReport, fight_id: int):
+    # Returns (gains per actor, dancer ids, duration in seconds) for one fight
+    key = (report_id, fight_id)
+    cached = PARTNER_FIGHT_CACHE.get(key)
+    if cached:
+        return cached
+    task = PARTNER_IN_FLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(stream_fight_partner(report_id, meta, fight_id))
+        PARTNER_IN_FLIGHT[key] = task
+        task.add_done_callback(lambda t: finish_partner_flight(key, t))
+    # A cancelled caller (e.g. a cancelled job) leaves the shared computation running for the others
+    return await asyncio.shield(task)
+
+def finish_partner_flight(key: tuple, task: "asyncio.Future") -> None:
+    PARTNER_IN_FLIGHT.pop(key, None)
+    if not task.cancelled():
+        task.exception()
+
+async def stream_fight_partner(report_id: str, meta: PartnerReport, fight_id: int):
+    fight = meta.fights[fight_id]
+    start, end = fight["startTime"], fight["endTime"]
+    async with partner_semaphore:
+        calc = VectorPartnerCalculator(meta.buff_columns, meta.owners)
+        async for event in iter_report_events(report_id, fight_id, start, end, PARTNER_BUFF_FILTER):
+            calc.feed_buff(event)
+        calc.close(end)
+        async for page in iter_report_pages(report_id, fight_id, start, end, PARTNER_DAMAGE_FILTER):
+            calc.feed_damage(page)
+    result = (calc.totals, frozenset(calc.dancers), (end - start) / 1000)
+    PARTNER_FIGHT_CACHE.put((report_id, fight_id), result)
+    return result
+
+def select_partner_fights(meta: PartnerReport, selection: Optional[str]) -> List[int]:
+    # None -> every kill; "last" -> the final encounter pull; otherwise comma-separated fight IDs.
+    # Trash fights have encounterID 0 and are never picked implicitly.
+    if not selection:
+        fight_ids = [fid for fid, f in meta.fights.items() if f.get("kill") and f.get("encounterID")]
+        if not fight_ids:
+            raise ValueError("No kills found in this report; pass a fight ID to evaluate a wipe.")
+        return fight_ids
+    if selection.strip().lower() == "last":
+        encounters = [fid for fid, f in meta.fights.items() if f.get("encounterID")]
+        if not encounters:
+            raise ValueError("This report has no encounter pulls.")
+        return [max(encounters)]
+    fight_ids = []
+    for part in selection.split(","):
+        try:
+            fid = int(part.strip())
+        except ValueError:
+            raise ValueError(
+                f"Invalid fight `{part.strip()}`: use comma-separated fight IDs (e.g. `3,7`) or `last`."
+            ) from None
+        if fid not in meta.fights:
+            raise ValueError(f"Fight {fid} not found in this report.")
+        if fid not in fight_ids:
+            fight_ids.append(fid)
+    return fight_ids
+
+def summarize_partner(meta: PartnerReport, fight_ids: List[int], parts: list):
+    # Per-fight parts -> (rows sorted by rDPS gain, total duration in seconds), aggregated per
+    # player across the fights
+    durations: Dict[int, float] = {}
+    for fid, (_, _, seconds) in zip(fight_ids, parts):
+        for actor_id in meta.fights[fid].get("friendlyPlayers") or meta.players:
+            durations[actor_id] = durations.get(actor_id, 0) + seconds
+    players = {actor_id: meta.players[actor_id] for actor_id in durations if actor_id in meta.players}
+    totals = merge_partner_totals(totals for totals, _, _ in parts)
+    dancers = set().union(*(dancers for _, dancers, _ in parts))
+    total_time = sum(seconds for _, _, seconds in parts)
+    if total_time <= 0:
+        raise ValueError("Invalid fight duration.")
+    return partner_rows(totals, dancers, players, total_time, durations), total_time
+
+def partner_embed(results: List[dict], total_time: float, fight_ids: List[int]) -> discord.Embed:
+    top = results[0]["rdps"]
     def fmt(v): return f"{v:,.2f}" if isinstance(v, float) else f"{v:,}"
     lines = [
         f"{'Name':<20} | {'Job':<12} | {'Standard':>10} | {'Devilment':>10} | {'Esprit':>10} | {'Total':>10} | {'RDPS':>8}",
         "-" * 95
     ]
     for row in results:
-        hl = "**" if row["rdps"] == top else ""
+        hl = "💃 " if row["rdps"] == top else ""
         lines.append(
-            f"{hl}{row['name']:<20} | {row['job']:<12} | {fmt(row['standard']):>10} | {fmt(row['devilment']):>10} | {fmt(row['esprit']):>10} | {fmt(row['total']):>10} | {fmt(row['rdps']):>8}{hl}"
+            f"{hl}{row['name']:<20} | {row['job']:<12} | {fmt(row['standard']):>10} | {fmt(row['devilment']):>10} | {fmt(row['esprit']):>10} | {fmt(row['total']):>10} | {fmt(row['rdps']):>8}"
         )
+    scope = f"Fight {fight_ids[0]}" if len(fight_ids) == 1 else f"{len(fight_ids)} fights ({', '.join(map(str, fight_ids))})"
     embed = discord.Embed(
         title="Dance Partner RDPS Gains",
-        description="```\n" + "\n".join(lines) + "\n```",
+        description=f"{scope} · {int(total_time // 60)}m {int(total_time % 60)}s\n```\n" + "\n".join(lines) + "\n```",
         color=discord.Color.purple()
     )
-    embed.set_footer(text="Source: FFLogs (DamageDone table)")
-    await interaction.followup.send(embed=embed)
+    embed.set_footer(text="Source: FFLogs (buff and damage events)")
+    return embed
+
+@analysis_job("dancepartner")
+async def run_partner_job(job: AnalysisJob) -> dict:
+    # Fights finish concurrently (bounded by partner_semaphore); each one is checkpointed as it lands.
+    # A failing fight doesn't cancel its siblings: they finish and are saved before the job fails.
+    report_id, fight_ids = job.args["report"], job.args["fights"]
+    meta = await load_partner_report(report_id)
+    done = job.checkpoint.setdefault("fights", {})
+
+    async def fight_part(fid: int):
+        return fid, await compute_fight_partner(report_id, meta, fid)
+
+    pending = [asyncio.create_task(fight_part(fid)) for fid in fight_ids if str(fid) not in done]
+    errors = []
+    try:
+        for next_part in asyncio.as_completed(pending):
+            try:
+                fid, part = await next_part
+            except Exception as e:
+                errors.append(e)
+                continue
+            done[str(fid)] = dump_partner_part(part)
+            await analysis_jobs.progress(job, f"{len(done)}/{len(fight_ids)} fights analysed")
+    finally:
+        for task in pending:
+            task.cancel()
+    if errors:
+        raise errors[0]
+    parts = [load_partner_part(done[str(fid)]) for fid in fight_ids]
+    results, total_time = summarize_partner(meta, fight_ids, parts)
+    if not results:
+        return {"content": "❌ No valid Dance Partner candidates found in these fights."}
+    embed = partner_embed(results, total_time, fight_ids)
+    message = bot.get_partial_messageable(job.channel_id, guild_id=job.guild_id).get_partial_message(job.message_id)
+    remember_response((job.channel_id, "dancepartner", report_id, job.args["selection"]), message, [embed])
+    return {"content": None, "embed": embed}
+
+@tree.command(name="dancepartner", description="Suggest the best Dance Partner based on a FFLogs report.", guild=discord.Object(id=GUILD_ID))
+@app_commands.describe(
+    link="The FFLogs report link (e.g. https://www.fflogs.com/reports/XXXXX or ...?fight=Y)",
+    fights="Fight IDs to evaluate, comma-separated (default: the link's ?fight=, else every kill)",
+    refresh="Rebuild even if this report was just posted here"
+)
+async def dancepartner(interaction: discord.Interaction, link: str, fights: Optional[str] = None, refresh: bool = False):
+    try:
+        report_id, selector = parse_report_link(link)
+        selection = fights or selector
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Invalid FFLogs link format: `{e}`", ephemeral=True)
+        return
+    normalized = (selection or "").replace(" ", "").lower()
+    key = memo_key(interaction, "dancepartner", report_id, normalized)
+    if refresh:
+        RESPONSE_MEMO.pop(key)
+        PARTNER_REPORT_CACHE.pop(report_id)
+    elif await reply_from_memo(interaction, key):
+        return
+    await interaction.response.defer()
+    try:
+        meta = await load_partner_report(report_id)
+        fight_ids = select_partner_fights(meta, selection)
+    except ValueError as e:
+        await interaction.followup.send(f"❌ {e}")
+        return
+    except Exception as e:
+        print("❌ Dance Partner error:", e)
+        await interaction.followup.send(f"❌ Dance Partner error: Unable to load the FFLogs report\n`{e}`")
+        return
+    try:
+        # Several uncached fights can take minutes: hand them to the job queue
+        if len(fight_ids) > 1 and any(PARTNER_FIGHT_CACHE.get((report_id, fid)) is None for fid in fight_ids):
+            message = await interaction.followup.send(f"⏳ Queued analysis of {len(fight_ids)} fights…", wait=True)
+            job_id = analysis_jobs.submit(
+                "dancepartner", {"report": report_id, "fights": fight_ids, "selection": normalized}, interaction, message,
+                resume=not refresh
+            )
+            await interaction.followup.send(f"Job #{job_id} queued; `/job_cancel {job_id}` stops it.", ephemeral=True)
+            return
+        parts = await asyncio.gather(*(compute_fight_partner(report_id, meta, fid) for fid in fight_ids))
+        results, total_time = summarize_partner(meta, fight_ids, parts)
+    except Exception as e:
+        print("❌ Dance Partner error:", e)
+        await interaction.followup.send(f"❌ Dance Partner error: Unable to evaluate buff windows from FFLogs events\n`{e}`")
+        return
+    if not results:
+        await interaction.followup.send("❌ No valid Dance Partner candidates found in this fight.")
+        return
+    embed = partner_embed(results, total_time, fight_ids)
+    message = await interaction.followup.send(embed=embed, wait=True)
+    remember_response(key, message, [embed])
 
 # === Sync & Restore on ready ===
 @bot.event
@@ -677,10 +2785,25 @@ async def on_ready():
     restored = 0
     for panel_id, panel in PANELS.items():
         guild = bot.get_guild(panel.guild_id)
-        if guild:
+        if guild and not panel.stale:
             bot.add_view(RolePanelView(panel, guild))
             restored += 1
 
+    # Registered characters feed /fflogs autocomplete; the watcher polls them in the background
+    for row in get_db().execute("SELECT name, server FROM watched_characters"):
+        CHARACTER_INDEX.add(f"{row['name']}@{row['server']}")
+    load_prefetch_guilds()
+    load_world_metadata()
+    resumed = analysis_jobs.start()
+    if resumed:
+        print(f"⏯️ Resuming {resumed} analysis job(s) interrupted by the last shutdown")
+    if not refresh_world_metadata.is_running():
+        refresh_world_metadata.start()
+    if not recent_logs_watcher.is_running():
+        recent_logs_watcher.start()
+    if not warm_character_cache.is_running():
+        warm_character_cache.start()
+
     print(f"✅ Logged in as {bot.user} (Restored {restored} reaction-role panels)")
     guild = discord.Object(id=GUILD_ID)
     guild_synced = await tree.sync(guild=guild)
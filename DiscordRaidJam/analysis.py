@@ -0,0 +1,244 @@
+# analysis.py
+# NumPy-backed event analysis. Event pages are converted to typed column arrays and buff-window
+# membership is resolved with searchsorted over sorted, non-overlapping intervals, so a fight's
+# damage is attributed page by page without Python-level per-event loops.
+import random
+import time
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import PARTNER_BONUS, PARTNER_BUFFS, PARTNER_COLUMNS, PartnerCalculator
+
+# field -> (event key, dtype, default for events that omit the key)
+EVENT_FIELDS = {
+    "timestamp": ("timestamp", np.int64, 0),
+    "source": ("sourceID", np.int64, -1),
+    "target": ("targetID", np.int64, -1),
+    "ability": ("abilityGameID", np.int64, 0),
+    "amount": ("amount", np.float64, 0),
+}
+
+def event_arrays(events: Sequence[dict], fields: Sequence[str] = tuple(EVENT_FIELDS)) -> Dict[str, np.ndarray]:
+    # Converting dicts is the only per-event work left; one itemgetter/fromiter pass per column
+    # keeps it in C and only touches the requested keys.
+    n = len(events)
+    arrays = {}
+    for field in fields:
+        key, dtype, default = EVENT_FIELDS[field]
+        try:
+            arrays[field] = np.fromiter(map(itemgetter(key), events), dtype=dtype, count=n)
+        except (KeyError, TypeError):
+            # Some events omit optional keys (or carry nulls)
+            arrays[field] = np.fromiter((e.get(key) or default for e in events), dtype=dtype, count=n)
+    return arrays
+
+def in_intervals(ts: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # Membership of each timestamp in [start, end) for sorted, non-overlapping intervals
+    if not len(starts):
+        return np.zeros(len(ts), dtype=bool)
+    idx = np.searchsorted(starts, ts, side="right") - 1
+    inside = idx >= 0
+    idx[~inside] = 0
+    return inside & (ts < ends[idx])
+
+def sweep_intervals(edges: Sequence[Tuple[int, int]], end_time: int) -> Tuple[np.ndarray, np.ndarray]:
+    # (timestamp, +1/-1) edges in stream order -> intervals where the open count is positive.
+    # Unmatched removals (buff applied before logging started) are ignored, like the reference.
+    starts: List[int] = []
+    ends: List[int] = []
+    count = 0
+    for ts, delta in edges:
+        if delta > 0:
+            if count == 0:
+                starts.append(ts)
+            count += 1
+        elif count > 0:
+            count -= 1
+            if count == 0:
+                ends.append(ts)
+    if count > 0:
+        ends.append(end_time)
+    return np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+
+class VectorPartnerCalculator:
+    # Same model as utils.PartnerCalculator, in two phases: feed the (small) buff event stream,
+    # close() it to build interval arrays, then feed damage event pages one at a time.
+    def __init__(self, buff_columns: Dict[int, str], owners: Optional[Dict[int, int]] = None):
+        self.buff_columns = buff_columns
+        self.owners = owners or {}
+        self.dancers: set = set()
+        self._window_edges: Dict[str, List[Tuple[int, int]]] = {c: [] for c in PARTNER_COLUMNS}
+        self._held_edges: Dict[Tuple[int, str], List[Tuple[int, int]]] = {}
+        self.windows: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        # Per column, every actor's held-buff intervals keyed as actor * span + timestamp: intervals of
+        # different actors can't overlap in that space, so one searchsorted covers all of them
+        self.held: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.span = 1
+        pets = sorted(self.owners)
+        self.pet_ids = np.asarray(pets, dtype=np.int64)
+        self.pet_owners = np.asarray([self.owners[p] for p in pets], dtype=np.int64)
+        self.totals: Dict[int, np.ndarray] = {}
+
+    def feed_buff(self, event: dict) -> None:
+        column = self.buff_columns.get(event.get("abilityGameID"))
+        etype = event.get("type")
+        if column is None or etype not in ("applybuff", "removebuff"):
+            return
+        delta = 1 if etype == "applybuff" else -1
+        source, target = event.get("sourceID"), event.get("targetID")
+        if source == target:
+            if delta > 0:
+                self.dancers.add(source)
+            self._window_edges[column].append((event["timestamp"], delta))
+        else:
+            self._held_edges.setdefault((target, column), []).append((event["timestamp"], delta))
+
+    def close(self, end_time: int) -> None:
+        self.windows = {c: sweep_intervals(edges, end_time) for c, edges in self._window_edges.items()}
+        self.span = end_time + 1
+        keyed: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        for (actor, column), edges in sorted(item for item in self._held_edges.items() if item[0][0] is not None):
+            starts, ends = sweep_intervals(edges, end_time)
+            keyed.setdefault(column, []).append((actor * self.span + starts, actor * self.span + ends))
+        self.held = {
+            column: (np.concatenate([s for s, _ in parts]), np.concatenate([e for _, e in parts]))
+            for column, parts in keyed.items()
+        }
+
+    def feed_damage(self, events: Sequence[dict]) -> None:
+        # Pages come from a damage-only filter, so there is no type column to check
+        cols = event_arrays(events, ("timestamp", "source", "amount"))
+        keep = cols["amount"] > 0
+        ts, source, amount = cols["timestamp"][keep], cols["source"][keep], cols["amount"][keep]
+        if not len(ts):
+            return
+        if len(self.pet_ids):
+            idx = np.minimum(np.searchsorted(self.pet_ids, source), len(self.pet_ids) - 1)
+            source = np.where(self.pet_ids[idx] == source, self.pet_owners[idx], source)
+        held_keys = source * self.span + ts
+        gains = np.zeros((len(ts), len(PARTNER_COLUMNS)))
+        for j, column in enumerate(PARTNER_COLUMNS):
+            starts, ends = self.windows.get(column, (np.empty(0, np.int64), np.empty(0, np.int64)))
+            inside = in_intervals(ts, starts, ends)
+            if not inside.any():
+                continue
+            bonus = PARTNER_BONUS[column]
+            factor = np.full(len(ts), bonus)
+            if column in self.held:
+                factor[in_intervals(held_keys, *self.held[column])] = bonus / (1 + bonus)
+            gains[:, j] = np.where(inside, amount * factor, 0.0)
+        actors, inverse = np.unique(source, return_inverse=True)
+        for j in range(len(PARTNER_COLUMNS)):
+            sums = np.bincount(inverse, weights=gains[:, j], minlength=len(actors))
+            for actor, value in zip(actors.tolist(), sums.tolist()):
+                if value:
+                    self.totals.setdefault(actor, np.zeros(len(PARTNER_COLUMNS)))[j] += value
+
+    def results(self, players: Dict[int, Tuple[str, str]], duration: float) -> List[dict]:
+        return partner_rows(self.totals, self.dancers, players, duration)
+
+def partner_rows(totals: Dict[int, np.ndarray], dancers: Iterable[int], players: Dict[int, Tuple[str, str]],
+                 duration: float, durations: Optional[Dict[int, float]] = None) -> List[dict]:
+    # Gains per actor (one value per PARTNER_COLUMNS entry) -> table rows sorted by rDPS.
+    # `durations` overrides the time base per actor (players who sat out some of the fights).
+    dancers = set(dancers)
+    durations = durations or {}
+    rows = []
+    for actor_id, (name, job) in players.items():
+        if actor_id in dancers:
+            continue
+        gains = totals.get(actor_id, np.zeros(len(PARTNER_COLUMNS)))
+        total = float(gains.sum())
+        seconds = durations.get(actor_id, duration)
+        row = {"name": name, "job": job}
+        row.update({column: round(float(value)) for column, value in zip(PARTNER_COLUMNS, gains)})
+        row["total"] = round(total)
+        row["rdps"] = round(total / seconds, 2) if seconds else 0
+        rows.append(row)
+    return sorted(rows, key=lambda r: r["rdps"], reverse=True)
+
+def merge_partner_totals(parts: Iterable[Dict[int, np.ndarray]]) -> Dict[int, np.ndarray]:
+    # Sum per-fight gains per actor, e.g. across every kill in a report
+    merged: Dict[int, np.ndarray] = {}
+    for totals in parts:
+        for actor_id, gains in totals.items():
+            if actor_id in merged:
+                merged[actor_id] = merged[actor_id] + gains
+            else:
+                merged[actor_id] = gains.copy()
+    return merged
+
+def dump_partner_part(part: Tuple[Dict[int, np.ndarray], Iterable[int], float]) -> dict:
+    # One fight's (gains per actor, dancer ids, duration) as plain JSON, for job checkpoints
+    totals, dancers, seconds = part
+    return {
+        "totals": {str(actor_id): gains.tolist() for actor_id, gains in totals.items()},
+        "dancers": sorted(dancers),
+        "seconds": seconds,
+    }
+
+def load_partner_part(data: dict) -> Tuple[Dict[int, np.ndarray], frozenset, float]:
+    totals = {int(actor_id): np.asarray(gains, dtype=np.float64) for actor_id, gains in data["totals"].items()}
+    return totals, frozenset(data["dancers"]), data["seconds"]
+
+# =========================
+# Benchmark: python analysis.py
+# =========================
+def synthetic_fight(minutes: int = 20, players: int = 8, hits_per_second: float = 120.0, seed: int = 7):
+    # A dancer (actor 1) with periodic Standard Finish / Devilment / Technical Finish windows,
+    # partnered with actor 2, plus a steady stream of damage from every player.
+    rng = random.Random(seed)
+    end = minutes * 60_000
+    buff_ids = {1001822: "Standard Finish", 1001825: "Devilment", 1001822 + 100: "Technical Finish"}
+    buff_columns = {gid: PARTNER_BUFFS[name][0] for gid, name in buff_ids.items()}
+    buffs = []
+    for gid, (period, length) in zip(buff_ids, ((30_000, 60_000), (120_000, 20_000), (120_000, 20_000))):
+        for start in range(5_000, end, period):
+            stop = min(start + length, end - 1)
+            for target in (1, 2):
+                buffs.append({"timestamp": start, "type": "applybuff", "abilityGameID": gid, "sourceID": 1, "targetID": target})
+                buffs.append({"timestamp": stop, "type": "removebuff", "abilityGameID": gid, "sourceID": 1, "targetID": target})
+    buffs.sort(key=lambda e: e["timestamp"])
+    count = int(end / 1000 * hits_per_second)
+    # Built in timestamp order, like dicts freshly decoded from an events page
+    damage = [
+        {"timestamp": ts, "type": "damage", "sourceID": rng.randint(1, players),
+         "targetID": 100, "abilityGameID": 7, "amount": rng.randint(1_000, 60_000)}
+        for ts in sorted(rng.randrange(end) for _ in range(count))
+    ]
+    roster = {i: (f"Player {i}", "Job") for i in range(1, players + 1)}
+    return buff_columns, buffs, damage, roster, end
+
+def benchmark(minutes: int = 20, page_size: int = 10_000) -> None:
+    buff_columns, buffs, damage, roster, end = synthetic_fight(minutes)
+    merged = sorted(buffs + damage, key=lambda e: e["timestamp"])
+    start = time.perf_counter()
+    reference = PartnerCalculator(buff_columns)
+    for event in merged:
+        reference.feed(event)
+    ref_rows = reference.results(roster, end / 1000)
+    ref_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector = VectorPartnerCalculator(buff_columns)
+    for event in buffs:
+        vector.feed_buff(event)
+    vector.close(end)
+    for i in range(0, len(damage), page_size):
+        vector.feed_damage(damage[i:i + page_size])
+    vec_rows = vector.results(roster, end / 1000)
+    vec_time = time.perf_counter() - start
+
+    worst = max(
+        abs(a["total"] - b["total"]) / max(a["total"], 1)
+        for a, b in zip(sorted(ref_rows, key=lambda r: r["name"]), sorted(vec_rows, key=lambda r: r["name"]))
+    )
+    print(f"{len(merged):,} events over {minutes} min")
+    print(f"pure Python reference: {ref_time * 1000:8.1f} ms")
+    print(f"NumPy vectorized:      {vec_time * 1000:8.1f} ms  ({ref_time / vec_time:.1f}x)")
+    print(f"max relative difference in totals: {worst:.2e}")
+
+if __name__ == "__main__":
+    benchmark()
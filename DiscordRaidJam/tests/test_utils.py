@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+from utils import PROGRESS_PULLS_SQL, parse_report_link
+
+def progress_db(fights):
+    db = sqlite3.connect(":memory:")
+    db.executescript("""
+        CREATE TABLE fight_store (report_code TEXT, fight_id INTEGER, encounter_id INTEGER, encounter_name TEXT,
+                                  start_at INTEGER, duration INTEGER, kill INTEGER, boss_pct REAL);
+        CREATE TABLE report_guilds (guild_id INTEGER, report_code TEXT);
+    """)
+    db.executemany("INSERT INTO fight_store VALUES (?, ?, 1, 'Boss', ?, 60000, ?, ?)", fights)
+    db.executemany("INSERT INTO report_guilds VALUES (1, ?)", {(f[0],) for f in fights})
+    return db
+
+def pulls(db):
+    return db.execute(PROGRESS_PULLS_SQL + "SELECT start_at, kill, boss_pct FROM pulls ORDER BY start_at", (1, 1)).fetchall()
+
+def test_pull_straddling_bucket_edge_counts_once():
+    # Two logs of one pull, 4 s apart across a multiple of 10 s
+    db = progress_db([("A", 1, 19_998_000, 0, 42.0), ("B", 3, 20_002_000, 0, 41.5)])
+    assert pulls(db) == [(19_998_000, 0, 41.5)]
+
+def test_pulls_further_apart_than_gap_stay_separate():
+    db = progress_db([
+        ("A", 1, 0, 0, 80.0), ("B", 1, 3_000, 0, 80.0),
+        ("A", 2, 120_000, 1, 0.0), ("B", 2, 125_000, 1, 0.0),
+        ("A", 3, 300_000, 0, 50.0),
+    ])
+    assert pulls(db) == [(0, 0, 80.0), (120_000, 1, 0.0), (300_000, 0, 50.0)]
+
+def test_parse_report_link_accepts_anonymous_codes():
+    assert parse_report_link("https://www.fflogs.com/reports/a:AbCdEfGh12345678?fight=last") == ("a:AbCdEfGh12345678", "last")
+    assert parse_report_link("a:AbCdEfGh12345678") == ("a:AbCdEfGh12345678", None)
+
+def test_parse_report_link_rejects_bad_codes():
+    for text in ("https://www.fflogs.com/reports/short", "b:AbCdEfGh12345678", "https://example.com/a/b"):
+        with pytest.raises(ValueError):
+            parse_report_link(text)
@@ -1 +1,829 @@
-﻿# utils.py
\ No newline at end of file
+﻿# utils.py
+import asyncio
+import random
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from difflib import get_close_matches
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# =========================
+# Report models
+# =========================
+class Role(IntEnum):
+    TANK = 0
+    HEALER = 1
+    DPS = 2
+
+# Role buckets as they appear in the `rankings` blob
+ROLE_KEYS = {"tanks": Role.TANK, "healers": Role.HEALER, "dps": Role.DPS}
+
+class Fight:
+    __slots__ = ("id", "encounter_id", "start_time", "end_time", "kill", "boss_pct")
+
+    def __init__(self, id: int, encounter_id: int, start_time: int, end_time: int, kill: bool, boss_pct: float):
+        self.id = id
+        self.encounter_id = encounter_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.kill = kill
+        self.boss_pct = boss_pct
+
+    @classmethod
+    def from_api(cls, data: dict) -> "Fight":
+        boss_pct = data.get("bossPercentage")
+        return cls(
+            data["id"],
+            data.get("encounterID") or 0,
+            data["startTime"],
+            data["endTime"],
+            bool(data.get("kill")),
+            100.0 if boss_pct is None else boss_pct,
+        )
+
+    @property
+    def duration(self) -> int:
+        return (self.end_time - self.start_time) // 1000
+
+class ParseEntry:
+    __slots__ = ("name", "role", "percent")
+
+    def __init__(self, name: str, role: Role, percent: float):
+        self.name = name
+        self.role = role
+        self.percent = percent
+
+class EncounterSummary:
+    __slots__ = ("encounter_id", "name", "kills", "wipes")
+
+    def __init__(self, encounter_id: int, name: str):
+        self.encounter_id = encounter_id
+        self.name = name
+        self.kills: List[Fight] = []
+        self.wipes: List[Fight] = []
+
+def summarize_fights(fights: Iterable[Fight], encounter_names: Dict[int, str]) -> Dict[int, EncounterSummary]:
+    # Group pulls per boss; trash (encounter 0) is skipped. Encounters keep first-seen order.
+    summaries: Dict[int, EncounterSummary] = {}
+    for fight in fights:
+        eid = fight.encounter_id
+        if eid == 0:
+            continue
+        summary = summaries.get(eid)
+        if summary is None:
+            summary = summaries[eid] = EncounterSummary(eid, encounter_names.get(eid, f"Encounter {eid}"))
+        (summary.kills if fight.kill else summary.wipes).append(fight)
+    return summaries
+
+def scope_fights(fights: Sequence[Fight], fight_ids: Optional[Sequence[int]] = None,
+                 encounter_id: Optional[int] = None, last: Optional[int] = None) -> List[Fight]:
+    # Boss pulls narrowed to the given fight ids and/or encounter, then to the last N of those
+    wanted = set(fight_ids) if fight_ids else None
+    scoped = [
+        f for f in fights
+        if f.encounter_id and (wanted is None or f.id in wanted) and (not encounter_id or f.encounter_id == encounter_id)
+    ]
+    return scoped[-last:] if last else scoped
+
+# Anonymized reports carry an `a:` prefix, which is part of the code the API expects
+REPORT_CODE_RE = re.compile(r"^(?:a:)?[A-Za-z0-9]{16}$")
+
+def parse_report_link(text: str) -> Tuple[str, Optional[str]]:
+    # FFLogs report URL (or bare code) -> (report code, fight selector from ?fight= / #fight=).
+    # The selector is a fight id as a string or "last"; raises ValueError on anything else.
+    text = text.strip()
+    if REPORT_CODE_RE.match(text):
+        # Bare code; an anonymized one would otherwise parse as a URL with scheme "a"
+        return text, None
+    parsed = urlparse(text)
+    parts = [p for p in parsed.path.split("/") if p]
+    if "reports" in parts and parts.index("reports") + 1 < len(parts):
+        code = parts[parts.index("reports") + 1]
+    elif len(parts) == 1 and not parsed.netloc and not parsed.scheme:
+        code = parts[0]
+    else:
+        raise ValueError("Not a FFLogs report link.")
+    if not REPORT_CODE_RE.match(code):
+        raise ValueError(f"`{code}` is not a FFLogs report code.")
+    fight = parse_qs(parsed.query).get("fight") or parse_qs(parsed.fragment).get("fight")
+    selector = fight[0].lower() if fight else None
+    if selector is not None and selector != "last" and not selector.isdigit():
+        raise ValueError(f"Unknown fight selector `{selector}`.")
+    return code, selector
+
+# =========================
+# FFLogs rankings projection
+# =========================
+
+class RankingsColumns:
+    # Columnar view of a report's `rankings` JSON holding only what /logreport renders:
+    # one row per (encounter id, fight id, role code, name id, rank percent).
+    __slots__ = ("eid", "fid", "role", "name_id", "percent", "names", "encounter_names", "spans")
+
+    def __init__(self):
+        self.eid = array("l")
+        self.fid = array("l")
+        self.role = array("B")
+        self.name_id = array("l")
+        self.percent = array("d")
+        self.names: List[str] = []
+        self.encounter_names: Dict[int, str] = {}
+        # (eid, fid) -> (start, end) row range; FFLogs emits one rankings entry per fight
+        self.spans: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.eid)
+
+    def rows(self, eid: int, fid: int) -> Iterator[ParseEntry]:
+        start, end = self.spans.get((eid, fid), (0, 0))
+        for i in range(start, end):
+            yield ParseEntry(self.names[self.name_id[i]], Role(self.role[i]), self.percent[i])
+
+def project_rankings(rankings: Optional[dict]) -> RankingsColumns:
+    # Walk the decoded blob once; everything not copied here is dropped with the response.
+    cols = RankingsColumns()
+    if not isinstance(rankings, dict):
+        return cols
+    name_ids: Dict[str, int] = {}
+    for r in rankings.get("data") or []:
+        enc = r.get("encounter") or {}
+        eid = enc.get("id")
+        if eid is None:
+            continue
+        cols.encounter_names.setdefault(eid, enc.get("name", f"Encounter {eid}"))
+        fid = r.get("fightID")
+        if fid is None:
+            continue
+        start = len(cols.eid)
+        roles = r.get("roles") or {}
+        for role_key, role in ROLE_KEYS.items():
+            for char in (roles.get(role_key) or {}).get("characters") or []:
+                # Tank/healer partner parses duplicate the pair; keep the primary entry only
+                if "name_2" in char:
+                    continue
+                name = char.get("name") or "?"
+                nid = name_ids.get(name)
+                if nid is None:
+                    nid = name_ids[name] = len(cols.names)
+                    # Interned so the same player across cached reports shares one string
+                    cols.names.append(sys.intern(name))
+                cols.eid.append(eid)
+                cols.fid.append(fid)
+                cols.role.append(role)
+                cols.name_id.append(nid)
+                cols.percent.append(char.get("rankPercent") or 0)
+        cols.spans[(eid, fid)] = (start, len(cols.eid))
+    return cols
+
+# =========================
+# Resilience helpers
+# =========================
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    # "Full jitter" exponential backoff: uniform in [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either delta-seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class CircuitBreaker:
+    # closed -> open after `failure_threshold` consecutive failures; after `reset_timeout`
+    # a single trial call is let through (half-open) and its outcome closes or re-opens it.
+    # allow() hands out the current generation as a token; the generation moves on whenever the
+    # breaker opens or a trial starts, so late outcomes of older calls are ignored.
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.generation = 1
+        self._trial: Optional[int] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> Optional[int]:
+        # A token for record_success/record_failure/release, or None to fail fast
+        state = self.state
+        if state == "closed":
+            return self.generation
+        if state == "half-open" and self._trial is None:
+            self.generation += 1
+            self._trial = self.generation
+            return self._trial
+        return None
+
+    def record_success(self, token: int) -> None:
+        if token != self.generation:
+            return
+        self.failures = 0
+        self.opened_at = None
+        self._trial = None
+
+    def record_failure(self, token: int) -> None:
+        if token != self.generation:
+            return
+        self.failures += 1
+        if self._trial is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.generation += 1
+        self._trial = None
+
+    def release(self, token: int) -> None:
+        # The trial call ended without an outcome (cancelled, or failed for an unrelated reason):
+        # free the slot so the next call can try again
+        if token == self._trial:
+            self._trial = None
+
+class TTLCache:
+    # Small LRU keyed cache. Entries are fresh for `ttl` seconds and may still be read
+    # through `get_stale` for `stale_ttl` seconds (e.g. while the upstream is down).
+    def __init__(self, ttl: float, stale_ttl: float = 0.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _lookup(self, key: Hashable, max_age: float) -> Optional[Tuple[Any, float]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        age = time.monotonic() - stored_at
+        if age > self.stale_ttl:
+            del self._data[key]
+            return None
+        if age > max_age:
+            return None
+        self._data.move_to_end(key)
+        return value, age
+
+    def get(self, key: Hashable) -> Any:
+        hit = self._lookup(key, self.ttl)
+        return hit[0] if hit else None
+
+    def get_stale(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        # (value, age in seconds) for fresh or stale entries
+        return self._lookup(key, self.stale_ttl)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+class SWRCache:
+    # Stale-while-revalidate cache for async loaders. Fresh entries (< ttl) are returned as is;
+    # stale entries (< stale_ttl) are returned immediately while one background refresh runs.
+    # Exceptions listed in `negative_exceptions` are cached for `negative_ttl` and re-raised.
+    def __init__(self, ttl: float, stale_ttl: float, negative_ttl: float = 0.0,
+                 negative_exceptions: Tuple[type, ...] = (), max_entries: int = 256):
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.negative_ttl = negative_ttl
+        self.negative_exceptions = negative_exceptions
+        self.max_entries = max_entries
+        # key -> (stored_at, value, error)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Optional[BaseException]]]" = OrderedDict()
+        self._inflight: Dict[Hashable, "asyncio.Future"] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def peek(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        # (value, age) of a usable positive entry without loading or refreshing anything
+        entry = self._live(key)
+        if entry is None or entry[2] is not None:
+            return None
+        return entry[1], time.monotonic() - entry[0]
+
+    def lookup(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        # Like peek, but a cached negative result is re-raised
+        entry = self._live(key)
+        if entry is None:
+            return None
+        if entry[2] is not None:
+            raise entry[2]
+        return entry[1], time.monotonic() - entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._store(key, value, None)
+
+    def put_error(self, key: Hashable, error: BaseException) -> None:
+        if self.negative_ttl > 0:
+            self._store(key, None, error)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Tuple[Any, float]:
+        # Returns (value, age in seconds)
+        entry = self._live(key)
+        if entry is not None:
+            stored_at, value, error = entry
+            if error is not None:
+                raise error
+            age = time.monotonic() - stored_at
+            if age > self.ttl:
+                self._start(key, loader)
+            return value, age
+        return await asyncio.shield(self._start(key, loader)), 0.0
+
+    def _live(self, key: Hashable):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        limit = self.negative_ttl if entry[2] is not None else self.stale_ttl
+        if time.monotonic() - entry[0] > limit:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _store(self, key: Hashable, value: Any, error: Optional[BaseException]) -> None:
+        self._data[key] = (time.monotonic(), value, error)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def _start(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> "asyncio.Future":
+        # One load per key at a time; concurrent callers share the same future
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f: self._finish(key, f))
+        return fut
+
+    def _finish(self, key: Hashable, fut: "asyncio.Future") -> None:
+        self._inflight.pop(key, None)
+        # Background refresh failures are dropped; the stale entry keeps being served
+        if not fut.cancelled():
+            fut.exception()
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader()
+        except self.negative_exceptions as e:
+            if self.negative_ttl > 0:
+                self._store(key, None, e)
+            raise
+        self._store(key, value, None)
+        return value
+
+# =========================
+# Autocomplete index
+# =========================
+class PrefixIndex:
+    # Sorted, case-folded keys searched with bisect; cheap enough to answer autocomplete inline
+    __slots__ = ("_keys", "_values")
+
+    def __init__(self, values: Iterable[str] = ()):
+        self._keys: List[str] = []
+        self._values: List[str] = []
+        for value in values:
+            self.add(value)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, value: str) -> bool:
+        key = value.casefold()
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def add(self, value: str) -> None:
+        key = value.casefold()
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return
+        self._keys.insert(i, key)
+        self._values.insert(i, value)
+
+    def search(self, prefix: str, limit: int = 25) -> List[str]:
+        key = prefix.casefold()
+        i = bisect_left(self._keys, key)
+        found: List[str] = []
+        while i < len(self._keys) and len(found) < limit and self._keys[i].startswith(key):
+            found.append(self._values[i])
+            i += 1
+        return found
+
+# FFXIV worlds per FFLogs server region (data centers flattened)
+WORLDS_BY_REGION: Dict[str, Tuple[str, ...]] = {
+    "NA": (
+        # Aether
+        "Adamantoise", "Cactuar", "Faerie", "Gilgamesh", "Jenova", "Midgardsormr", "Sargatanas", "Siren",
+        # Crystal
+        "Balmung", "Brynhildr", "Coeurl", "Diabolos", "Goblin", "Malboro", "Mateus", "Zalera",
+        # Dynamis
+        "Cuchulainn", "Golem", "Halicarnassus", "Kraken", "Maduin", "Marilith", "Rafflesia", "Seraph",
+        # Primal
+        "Behemoth", "Excalibur", "Exodus", "Famfrit", "Hyperion", "Lamia", "Leviathan", "Ultros",
+    ),
+    "EU": (
+        # Chaos
+        "Cerberus", "Louisoix", "Moogle", "Omega", "Phantom", "Ragnarok", "Sagittarius", "Spriggan",
+        # Light
+        "Alpha", "Lich", "Odin", "Phoenix", "Raiden", "Shiva", "Twintania", "Zodiark",
+    ),
+    "OC": (
+        # Materia
+        "Bismarck", "Ravana", "Sephirot", "Sophia", "Zurvan",
+    ),
+    "JP": (
+        # Elemental
+        "Aegis", "Atomos", "Carbuncle", "Garuda", "Gungnir", "Kujata", "Tonberry", "Typhon",
+        # Gaia
+        "Alexander", "Bahamut", "Durandal", "Fenrir", "Ifrit", "Ridill", "Tiamat", "Ultima",
+        # Mana
+        "Anima", "Asura", "Chocobo", "Hades", "Ixion", "Masamune", "Pandaemonium", "Titan",
+        # Meteor
+        "Belias", "Mandragora", "Ramuh", "Shinryu", "Unicorn", "Valefor", "Yojimbo", "Zeromus",
+    ),
+}
+# CN and KR worlds are not listed; characters there are located on FFLogs (or given a region)
+UNLISTED_REGIONS = ("CN", "KR")
+REGIONS = tuple(WORLDS_BY_REGION) + UNLISTED_REGIONS
+# casefolded world -> (display name, region)
+WORLD_REGIONS: Dict[str, Tuple[str, str]] = {
+    world.casefold(): (world, region) for region, worlds in WORLDS_BY_REGION.items() for world in worlds
+}
+
+def find_world(name: str) -> Optional[Tuple[str, str]]:
+    return WORLD_REGIONS.get(name.strip().casefold())
+
+def close_worlds(name: str, limit: int = 3) -> List[str]:
+    # Known worlds within a typo or two of `name`, best match first
+    matches = get_close_matches(name.strip().casefold(), WORLD_REGIONS, n=limit, cutoff=0.75)
+    return [WORLD_REGIONS[m][0] for m in matches]
+
+def parse_character(text: str) -> Tuple[str, str]:
+    # "Name Surname@Server" -> ("Name Surname", "Server"); raises ValueError on bad input
+    full_name, server = text.split("@")
+    first_name, last_name = full_name.strip().split(" ", 1)
+    return f"{first_name} {last_name.strip()}", server.strip()
+
+# =========================
+# FFLogs world metadata
+# =========================
+class WorldMetadata:
+    # worldData zones with their encounters and partitions, indexed for name lookups and
+    # autocomplete. `version` is a content hash, so a refresh that changed nothing is cheap to spot.
+    __slots__ = ("zones", "encounter_names", "encounter_zones", "version", "fetched_at")
+
+    def __init__(self, zones: Sequence[dict] = (), version: str = "", fetched_at: float = 0.0):
+        # Newest zones first (higher ids), so current content leads the choices
+        self.zones: Dict[int, dict] = {z["id"]: z for z in sorted(zones, key=lambda z: z["id"], reverse=True)}
+        self.encounter_names: Dict[int, str] = {}
+        self.encounter_zones: Dict[int, int] = {}
+        for zone in self.zones.values():
+            for enc in zone.get("encounters") or []:
+                self.encounter_names.setdefault(enc["id"], enc["name"])
+                self.encounter_zones.setdefault(enc["id"], zone["id"])
+        self.version = version
+        self.fetched_at = fetched_at
+
+    def zone_choices(self, current: str, limit: int = 25) -> List[Tuple[str, int]]:
+        needle = current.strip().casefold()
+        return [
+            (f"{z['name']} ({(z.get('expansion') or {}).get('name', '?')})", zid)
+            for zid, z in self.zones.items() if needle in z["name"].casefold()
+        ][:limit]
+
+    def partition_choices(self, zone_id: Optional[int], current: str, limit: int = 25) -> List[Tuple[str, int]]:
+        zone = self.zones.get(zone_id) if zone_id else None
+        needle = current.strip().casefold()
+        return [
+            (p["name"] + (" (default)" if p.get("default") else ""), p["id"])
+            for p in (zone or {}).get("partitions") or [] if needle in p["name"].casefold()
+        ][:limit]
+
+    def encounter_choices(self, current: str, limit: int = 25) -> List[Tuple[str, int]]:
+        needle = current.strip().casefold()
+        return [
+            (f"{name} – {self.zones[self.encounter_zones[eid]]['name']}", eid)
+            for eid, name in self.encounter_names.items() if needle in name.casefold()
+        ][:limit]
+
+# =========================
+# Batched FFLogs queries
+# =========================
+RATE_LIMIT_FIELDS = "rateLimitData { limitPerHour pointsSpentThisHour pointsResetIn }"
+
+def batch_character_query(count: int, selection: str, with_rate_limit: bool = False) -> str:
+    # One request for many characters: aliases c0..cN, each with its own typed variables
+    params = ", ".join(f"$n{i}: String!, $s{i}: String!, $r{i}: String!" for i in range(count))
+    fields = "\n".join(
+        f"    c{i}: character(name: $n{i}, serverSlug: $s{i}, serverRegion: $r{i}) {{ {selection} }}"
+        for i in range(count)
+    )
+    rate = f"  {RATE_LIMIT_FIELDS}\n" if with_rate_limit else ""
+    return f"query({params}) {{\n{rate}  characterData {{\n{fields}\n  }}\n}}"
+
+def batch_character_variables(characters: Sequence[Tuple[str, str, str]]) -> Dict[str, str]:
+    variables: Dict[str, str] = {}
+    for i, (name, server, region) in enumerate(characters):
+        variables[f"n{i}"] = name
+        variables[f"s{i}"] = server
+        variables[f"r{i}"] = region
+    return variables
+
+class ApiBudget:
+    # Mirror of FFLogs' hourly point budget, refreshed from `rateLimitData` and advanced locally
+    # in between, so background work can stay under a ceiling and leave room for commands.
+    def __init__(self, limit_per_hour: float = 3600.0):
+        self.limit_per_hour = limit_per_hour
+        self.spent = 0.0
+        self.reset_at = time.monotonic() + 3600
+
+    def _roll(self) -> None:
+        now = time.monotonic()
+        if now >= self.reset_at:
+            self.spent = 0.0
+            self.reset_at = now + 3600
+
+    def update(self, rate: Optional[dict]) -> None:
+        if not rate:
+            return
+        self.limit_per_hour = rate.get("limitPerHour") or self.limit_per_hour
+        self.spent = rate.get("pointsSpentThisHour") or 0.0
+        self.reset_at = time.monotonic() + (rate.get("pointsResetIn") or 3600)
+
+    def record(self, points: float) -> None:
+        self._roll()
+        self.spent += points
+
+    def allows(self, points: float, ceiling: float = 1.0) -> bool:
+        # ceiling is the fraction of the hourly limit this caller may push total spend up to
+        self._roll()
+        return self.spent + points <= self.limit_per_hour * ceiling
+
+def watch_interval(seconds_since_activity: float) -> float:
+    # Poll recently active characters often and dormant ones rarely, with +-20% jitter
+    # so a large roster does not come due in the same tick.
+    if seconds_since_activity < 86400:
+        base = 600
+    elif seconds_since_activity < 7 * 86400:
+        base = 1800
+    else:
+        base = 7200
+    return base * random.uniform(0.8, 1.2)
+
+def align_encounters(rankings_per_character: Sequence[Sequence[dict]]) -> List[Tuple[str, List[Optional[dict]]]]:
+    # Join zoneRankings lists on encounter id: [(encounter name, [ranking or None per character])]
+    names: Dict[int, str] = {}
+    table: Dict[int, List[Optional[dict]]] = {}
+    count = len(rankings_per_character)
+    for idx, rankings in enumerate(rankings_per_character):
+        for log in rankings:
+            enc = log.get("encounter") or {}
+            eid = enc.get("id")
+            if eid is None:
+                continue
+            row = table.get(eid)
+            if row is None:
+                names[eid] = enc.get("name", f"Encounter {eid}")
+                row = table[eid] = [None] * count
+            row[idx] = log
+    return [(names[eid], table[eid]) for eid in names]
+
+# =========================
+# Dance Partner engine
+# =========================
+# Damage bonus each dancer buff would grant a partner. Devilment's +20% crit and direct hit
+# rate is folded into an expected multiplier: 0.2 * ~0.55 crit bonus + 0.2 * 0.25 DH bonus.
+PARTNER_BUFFS: Dict[str, Tuple[str, float]] = {
+    "Standard Finish": ("standard", 0.05),
+    "Devilment": ("devilment", 0.16),
+    "Technical Finish": ("esprit", 0.05),
+}
+PARTNER_COLUMNS = tuple(column for column, _ in PARTNER_BUFFS.values())
+PARTNER_BONUS = dict(PARTNER_BUFFS.values())
+
+class PartnerCalculator:
+    # Single pass over a time-ordered event stream (buff + damage events), keeping only running
+    # totals. Windows open and close on the dancer's self-applied buffs; every player's damage
+    # inside an open window is credited with what that buff would add if they were the partner.
+    # Players who really hold the buff already dealt buffed damage, so only the bonus share of
+    # their hit counts.
+    __slots__ = ("buff_columns", "owners", "open", "received", "dancers", "totals")
+
+    def __init__(self, buff_columns: Dict[int, str], owners: Optional[Dict[int, int]] = None):
+        self.buff_columns = buff_columns          # ability game id -> column
+        self.owners = owners or {}                # pet actor id -> owner actor id
+        self.open: Dict[str, int] = {}            # column -> open self-buff count
+        self.received: set = set()                # (actor id, column) holding the real buff
+        self.dancers: set = set()
+        self.totals: Dict[int, Dict[str, float]] = {}
+
+    def feed(self, event: dict) -> None:
+        etype = event.get("type")
+        if etype == "damage":
+            if not self.open:
+                return
+            amount = event.get("amount") or 0
+            if amount <= 0:
+                return
+            source = event.get("sourceID")
+            source = self.owners.get(source, source)
+            row = self.totals.get(source)
+            if row is None:
+                row = self.totals[source] = dict.fromkeys(PARTNER_COLUMNS, 0.0)
+            for column in self.open:
+                bonus = PARTNER_BONUS[column]
+                if (source, column) in self.received:
+                    row[column] += amount * bonus / (1 + bonus)
+                else:
+                    row[column] += amount * bonus
+            return
+        column = self.buff_columns.get(event.get("abilityGameID"))
+        if column is None:
+            return
+        source, target = event.get("sourceID"), event.get("targetID")
+        if etype == "applybuff":
+            if source == target:
+                self.dancers.add(source)
+                self.open[column] = self.open.get(column, 0) + 1
+            else:
+                self.received.add((target, column))
+        elif etype == "removebuff":
+            if source == target:
+                count = self.open.get(column, 0) - 1
+                if count > 0:
+                    self.open[column] = count
+                else:
+                    self.open.pop(column, None)
+            else:
+                self.received.discard((target, column))
+
+    def results(self, players: Dict[int, Tuple[str, str]], duration: float) -> List[dict]:
+        # players: actor id -> (name, job). The dancer cannot partner themselves.
+        rows = []
+        for actor_id, (name, job) in players.items():
+            if actor_id in self.dancers:
+                continue
+            gains = self.totals.get(actor_id) or dict.fromkeys(PARTNER_COLUMNS, 0.0)
+            total = sum(gains.values())
+            row = {"name": name, "job": job}
+            row.update({column: round(value) for column, value in gains.items()})
+            row["total"] = round(total)
+            row["rdps"] = round(total / duration, 2) if duration else 0
+            rows.append(row)
+        return sorted(rows, key=lambda r: r["rdps"], reverse=True)
+
+# =========================
+# /progress pulls
+# =========================
+# The same pull logged by several raiders appears in several reports a few seconds apart.
+# Fights of one encounter are ordered by start; a gap over PULL_MERGE_GAP_MS starts a new pull
+# and the running count of those breaks numbers the pulls, so nothing hinges on bucket edges.
+# Parameters: guild id, encounter id. Yields a `pulls` CTE (start_at, kill, boss_pct, duration).
+PULL_MERGE_GAP_MS = 10_000
+PROGRESS_PULLS_SQL = f"""
+WITH ordered AS (
+    SELECT f.start_at, f.kill, f.boss_pct, f.duration, f.report_code, f.fight_id,
+           CASE WHEN f.start_at - LAG(f.start_at) OVER (ORDER BY f.start_at, f.report_code, f.fight_id)
+                     <= {PULL_MERGE_GAP_MS} THEN 0 ELSE 1 END AS new_pull
+    FROM fight_store f JOIN report_guilds g ON g.report_code = f.report_code
+    WHERE g.guild_id = ? AND f.encounter_id = ?
+), numbered AS (
+    SELECT *, SUM(new_pull) OVER (ORDER BY start_at, report_code, fight_id ROWS UNBOUNDED PRECEDING) AS pull_no
+    FROM ordered
+), pulls AS (
+    SELECT MIN(start_at) AS start_at, MAX(kill) AS kill, MIN(boss_pct) AS boss_pct, MAX(duration) AS duration
+    FROM numbered GROUP BY pull_no
+)
+"""
+
+# =========================
+# Wipe counter sessions
+# =========================
+WIPE_PCT_BUCKETS = 10          # boss HP% in 10% steps
+WIPE_DURATION_BUCKET = 60      # seconds per duration bucket
+WIPE_DURATION_BUCKETS = 15     # the last bucket collects everything past 14 minutes
+
+class EncounterTally:
+    # Running counters for one encounter; updated per fight, read in constant time
+    __slots__ = ("name", "pulls", "kills", "best_pct", "time", "wipe_pct_hist", "wipe_duration_hist")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pulls = 0
+        self.kills = 0
+        self.best_pct = 100.0
+        self.time = 0
+        self.wipe_pct_hist = [0] * WIPE_PCT_BUCKETS
+        self.wipe_duration_hist = [0] * WIPE_DURATION_BUCKETS
+
+    @property
+    def wipes(self) -> int:
+        return self.pulls - self.kills
+
+    @property
+    def kill_rate(self) -> float:
+        return self.kills / self.pulls if self.pulls else 0.0
+
+    def add(self, fight: Fight) -> None:
+        self.pulls += 1
+        self.time += fight.duration
+        if fight.kill:
+            self.kills += 1
+            self.best_pct = 0.0
+            return
+        self.best_pct = min(self.best_pct, fight.boss_pct)
+        self.wipe_pct_hist[min(int(fight.boss_pct // (100 / WIPE_PCT_BUCKETS)), WIPE_PCT_BUCKETS - 1)] += 1
+        self.wipe_duration_hist[min(fight.duration // WIPE_DURATION_BUCKET, WIPE_DURATION_BUCKETS - 1)] += 1
+
+    def to_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "EncounterTally":
+        tally = cls(data["name"])
+        for slot in cls.__slots__:
+            setattr(tally, slot, data.get(slot, getattr(tally, slot)))
+        return tally
+
+class WipeSession:
+    # Per channel or user: encounter tallies plus, per report, the highest fight id already
+    # counted, so re-feeding a growing live report only adds its new pulls.
+    __slots__ = ("tallies", "watermarks")
+
+    def __init__(self):
+        self.tallies: Dict[int, EncounterTally] = {}
+        self.watermarks: Dict[str, int] = {}
+
+    def feed(self, report_code: str, fights: Iterable[Fight], encounter_names: Dict[int, str]) -> int:
+        # Returns the number of newly counted pulls; trash (encounter 0) is skipped
+        seen = self.watermarks.get(report_code, 0)
+        newest = seen
+        added = 0
+        for fight in fights:
+            if fight.id <= seen:
+                continue
+            newest = max(newest, fight.id)
+            eid = fight.encounter_id
+            if eid == 0:
+                continue
+            tally = self.tallies.get(eid)
+            if tally is None:
+                tally = self.tallies[eid] = EncounterTally(encounter_names.get(eid, f"Encounter {eid}"))
+            tally.add(fight)
+            added += 1
+        self.watermarks[report_code] = newest
+        return added
+
+    def to_dict(self) -> dict:
+        return {
+            "tallies": {str(eid): tally.to_dict() for eid, tally in self.tallies.items()},
+            "watermarks": self.watermarks,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "WipeSession":
+        session = cls()
+        session.tallies = {int(eid): EncounterTally.from_dict(t) for eid, t in data.get("tallies", {}).items()}
+        session.watermarks = dict(data.get("watermarks", {}))
+        return session
+
+SPARK_BLOCKS = "▁▂▃▄▅▆▇█"
+
+def sparkline(counts: Sequence[int]) -> str:
+    peak = max(counts, default=0)
+    if not peak:
+        return SPARK_BLOCKS[0] * len(counts)
+    return "".join(SPARK_BLOCKS[(c * (len(SPARK_BLOCKS) - 1) + peak - 1) // peak] for c in counts)